@@ -1,15 +1,26 @@
 import os
-from flask import Flask, redirect, render_template, request, url_for, session, g, flash
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone
+from flask import Flask, redirect, render_template, request, url_for, session, g, flash, make_response, send_file
+from flask_wtf.csrf import generate_csrf
+from flask_session import Session
+from cachelib import FileSystemCache
 from dotenv import load_dotenv
-import pgeocode
-import pygeohash as pgh
 from sqlalchemy.exc import IntegrityError, PendingRollbackError
+from requests import RequestException
 from validators import url as validate_url
 
-from models import db, connect_db, User, Artist, UserArtist, Event, UserEvent, WishList
+from models import db, connect_db, User, Artist, UserArtist, Event, WishList, SpotifyProfile, utc_now
 from forms import NewUserForm, LoginForm, EditUserForm, ChangePasswordForm, ChangePfpForm
-from ticketmaster import TicketmasterAPI
+from ticketmaster import TicketmasterAPI, TicketmasterError
+from rate_limit import RateLimiter, RateLimitError
+from cache import TTLCache
 from spotify import SpotifyAPI
+from spotify_tokens import SpotifyTokenManager
+from user_context import UserContext, uses_user
+from images import ImageCache
 
 load_dotenv()
 app = Flask(__name__)
@@ -23,6 +34,28 @@ app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
 connect_db(app)
 
+    # sessions are kept on the server and the cookie only holds the session id. SESSION_BACKEND is
+    # sqlalchemy (a sessions table in the app data base), filesystem (local files, for a single server) or cookie (the signed cookie)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlalchemy')
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=int(os.environ.get('SESSION_LIFETIME_DAYS', 31)))
+    # only writes the session when it changes instead of on every request
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+if SESSION_BACKEND == 'sqlalchemy':
+    app.config['SESSION_TYPE'] = 'sqlalchemy'
+    app.config['SESSION_SQLALCHEMY'] = db
+    app.config['SESSION_SQLALCHEMY_TABLE'] = 'sessions'
+        # deletes expired sessions on about one in every N requests, or run: flask session_cleanup
+    app.config['SESSION_CLEANUP_N_REQUESTS'] = int(os.environ.get('SESSION_CLEANUP_N_REQUESTS', 1000))
+elif SESSION_BACKEND == 'filesystem':
+    app.config['SESSION_TYPE'] = 'cachelib'
+    app.config['SESSION_CACHELIB'] = FileSystemCache(cache_dir=os.environ.get('SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions')), threshold=int(os.environ.get('SESSION_FILE_THRESHOLD', 10000)))
+elif SESSION_BACKEND != 'cookie':
+    raise ValueError(f'unknown SESSION_BACKEND {SESSION_BACKEND}')
+
+if SESSION_BACKEND != 'cookie':
+    Session(app)
+
 with app.app_context():
     db.create_all()
 
@@ -31,59 +64,113 @@ CUR_U_ID = 'user id'
 SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIFY_REDIRECT_URI')
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
+SPOTIFY_BASE_URL = os.environ.get('SPOTIFY_BASE_URL', 'https://api.spotify.com/v1')
+SPOTIFY_TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
 
 TICKETMASTER_API_KEY = os.environ.get('TICKETMASTER_API_KEY')
-
-spotify = SpotifyAPI(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET, redirect_uri=SPOTIFY_REDIRECT_URI)
-ticketmaster = TicketmasterAPI(api_key=TICKETMASTER_API_KEY)
+TICKETMASTER_BASE_URL = os.environ.get('TICKETMASTER_BASE_URL', 'https://app.ticketmaster.com/discovery/v2')
+TICKETMASTER_MAX_WORKERS = int(os.environ.get('TICKETMASTER_MAX_WORKERS', 10))
+TICKETMASTER_RATE_LIMIT = float(os.environ.get('TICKETMASTER_RATE_LIMIT', 5))
+TICKETMASTER_DAILY_QUOTA = int(os.environ.get('TICKETMASTER_DAILY_QUOTA', 5000))
+    # rate limited requests that are told to wait longer than this many seconds fail instead of waiting
+TICKETMASTER_MAX_RETRY_AFTER = float(os.environ.get('TICKETMASTER_MAX_RETRY_AFTER', 10))
+    # events.json pages, the next page is requested while the current one is read
+TICKETMASTER_PAGE_SIZE = int(os.environ.get('TICKETMASTER_PAGE_SIZE', 50))
+TICKETMASTER_MAX_PAGES = int(os.environ.get('TICKETMASTER_MAX_PAGES', 5))
+
+GENERIC_EVENTS_TTL = int(os.environ.get('GENERIC_EVENTS_TTL', 3600))
+GENERIC_EVENTS_CACHE_SIZE = int(os.environ.get('GENERIC_EVENTS_CACHE_SIZE', 256))
+GEOHASH_PRECISION = int(os.environ.get('GEOHASH_PRECISION', 4))
+
+    # events near a user come from the data base once at least NEARBY_EVENTS_MIN saved events are within the radius
+NEARBY_RADIUS_MILES = float(os.environ.get('NEARBY_RADIUS_MILES', 50))
+NEARBY_EVENTS_MIN = int(os.environ.get('NEARBY_EVENTS_MIN', 10))
+
+    # the logged out homepage is the same for everyone, it is rendered once per PAGE_CACHE_TTL seconds
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+page_cache = TTLCache(maxsize=16, ttl=PAGE_CACHE_TTL)
+
+    # saved spotify top artists and tracks are reused for SPOTIFY_PROFILE_TTL_HOURS, /switch-accounts always fetches them again
+SPOTIFY_PROFILE_TTL = timedelta(hours=float(os.environ.get('SPOTIFY_PROFILE_TTL_HOURS', 24)))
+FORCE_SPOTIFY_REFRESH = 'force spotify refresh'
+
+    # wishlist pages hold WISHLIST_PAGE_SIZE events, ?limit= can ask for up to WISHLIST_MAX_PAGE_SIZE
+WISHLIST_PAGE_SIZE = int(os.environ.get('WISHLIST_PAGE_SIZE', 24))
+WISHLIST_MAX_PAGE_SIZE = int(os.environ.get('WISHLIST_MAX_PAGE_SIZE', 100))
+
+EVENTS_MAX_AGE = timedelta(hours=float(os.environ.get('EVENTS_MAX_AGE_HOURS', 6)))
+
+    # event and artist images are resized to IMAGE_WIDTHS and saved as webp in IMAGE_CACHE_DIR, up to IMAGE_CACHE_MAX_MB.
+    # only images from IMAGE_ALLOWED_HOSTS (and their subdomains) are resized, others are linked as they are
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'images'))
+IMAGE_CACHE_MAX_MB = float(os.environ.get('IMAGE_CACHE_MAX_MB', 256))
+IMAGE_WIDTHS = [int(width) for width in os.environ.get('IMAGE_WIDTHS', '160,320,640').split(',')]
+IMAGE_ALLOWED_HOSTS = os.environ.get('IMAGE_ALLOWED_HOSTS', 'ticketm.net,scdn.co,spotifycdn.com').split(',')
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 30 * 24 * 3600))
+image_cache = ImageCache(IMAGE_CACHE_DIR, widths=IMAGE_WIDTHS, allowed_hosts=IMAGE_ALLOWED_HOSTS, max_bytes=int(IMAGE_CACHE_MAX_MB * 1024 * 1024))
+
+    # background refreshes for /top-artists-events, refreshing_artists stops the same artist being queued twice
+refresh_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('EVENT_REFRESH_WORKERS', 2)))
+refreshing_artists = set()
+refreshing_lock = threading.Lock()
+
+spotify = SpotifyAPI(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET, redirect_uri=SPOTIFY_REDIRECT_URI, base_url=SPOTIFY_BASE_URL, token_url=SPOTIFY_TOKEN_URL)
+    # spotify tokens with less than SPOTIFY_REFRESH_MARGIN seconds left are refreshed before they expire,
+    # each worker keeps up to SPOTIFY_TOKEN_CACHE_SIZE users tokens until they expire
+spotify_tokens = SpotifyTokenManager(spotify, refresh_margin=int(os.environ.get('SPOTIFY_REFRESH_MARGIN', 300)), executor=refresh_executor, app=app, max_tokens=int(os.environ.get('SPOTIFY_TOKEN_CACHE_SIZE', 1024)))
+ticketmaster = TicketmasterAPI(api_key=TICKETMASTER_API_KEY, base_url=TICKETMASTER_BASE_URL, max_workers=TICKETMASTER_MAX_WORKERS, rate_limiter=RateLimiter(rate=TICKETMASTER_RATE_LIMIT, daily_quota=TICKETMASTER_DAILY_QUOTA, max_retry_after=TICKETMASTER_MAX_RETRY_AFTER), generic_events_cache=TTLCache(maxsize=GENERIC_EVENTS_CACHE_SIZE, ttl=GENERIC_EVENTS_TTL), geohash_precision=GEOHASH_PRECISION, page_size=TICKETMASTER_PAGE_SIZE, max_pages=TICKETMASTER_MAX_PAGES)
 
 
 @app.before_request
 def add_user_to_g():
-    ''' adds currently logged in user to flask g for global use'''
+    ''' adds currently logged in user to flask g for global use. g.user_ctx keeps the users relationships once loaded for the rest of the request'''
 
     if CUR_U_ID in session:
-        g.user = User.query.filter_by(id=session[CUR_U_ID]).first()
+        g.user = db.session.get(User, session[CUR_U_ID])
 
     else:
         g.user = None
+
+    g.user_ctx = UserContext(g.user) if g.user else None
         
 
 @app.route('/')
+@uses_user('artists')
 def homepage():
-    ''' returns homepage template based on if a user is logged in or if spotify is connected'''
-
-        # gets list of generic events
-    generic_events = ticketmaster.get_generic_events()
-        # puts generic events in groups for carousel
-    all_generic_events = [generic_events[0:5], generic_events[5:10], generic_events[10:15], generic_events[15:]]
-
-        # creates list of 5 generic artists for if spotify is not connected
-    generic_artists = []
-    for i in range(5):
-        artist = Artist.query.filter_by(id=i+1).first()
-        generic_artists.append(artist)
+    ''' returns homepage template based on if a user is logged in or if spotify is connected. the logged out page is cached and can be cached by proxies, unless there are flashed messages to show'''
 
     if not g.user:
-        form = LoginForm()
-        return render_template('generic-homepage.html', form=form, all_events=all_generic_events, generic_artists=generic_artists)
+        if '_flashes' in session:
+            return render_generic_homepage(LoginForm())
+
+            # the cached page has no csrf token in it, static/app.js gets one from /csrf-token
+        html, etag = page_cache.get_or_set('generic-homepage', lambda: cache_page(render_generic_homepage(LoginForm(meta={'csrf': False}), csrf_placeholder=True)))
+
+        response = make_response(html)
+        response.set_etag(etag)
+            # browsers revalidate with the etag every time so they never show the logged out page after logging in,
+            # shared caches keep it for PAGE_CACHE_TTL and the cookie changes on login
+        response.headers['Cache-Control'] = f'public, max-age=0, s-maxage={PAGE_CACHE_TTL}'
+        response.headers['Vary'] = 'Cookie'
+        return response.make_conditional(request)
+
+    all_generic_events = get_generic_event_groups()
+    generic_artists = get_generic_artists()
     
-    user = User.query.filter_by(username=g.user.username).first()
+    user = g.user
 
     if user:
-        zipcode = user.zipcode
-        coords = get_lat_long(zipcode)
-        geohash = get_geohash(coords)
-
             # gets events based on users location
-        generic_events_geohash = ticketmaster.get_generic_events(geohash=geohash)
+        generic_events_geohash = get_events_near_user(user)
 
-            # gets list of users wishlist
-        wishlist = [event.event_id for event in user.wishlist]
+            # gets which of the shown events are on the users wishlist
+        wishlist = g.user_ctx.wishlisted(get_event_ids(*all_generic_events, generic_events_geohash))
 
         if session.get('spotify_token', None):
-            artists = user.artists
-            top_tracks = session['top_tracks']
+            profile = refresh_spotify_profile(user)
+            artists = g.user_ctx.artists
+                # sessions from before profiles were saved still have top tracks in them
+            top_tracks = (profile.top_tracks if profile else session.get('top_tracks')) or []
 
             if artists:
                 artist_num = 1
@@ -106,7 +193,45 @@ def homepage():
             
         return render_template('user-homepage.html', user=user, all_events=all_generic_events, generic_artists=generic_artists, generic_events_geohash=generic_events_geohash, wishlist=wishlist)
     
-    return render_template('generic-homepage.html', all_events=all_generic_events, generic_artists=generic_artists)
+    return render_generic_homepage(LoginForm())
+
+
+@app.route('/csrf-token')
+def csrf_token():
+    ''' returns a csrf token for forms on cached pages. never cached because the token belongs to the session '''
+
+    response = make_response({'csrf_token': generate_csrf()})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route('/img')
+def image_variant():
+    ''' returns an event or artist image resized to the saved width for w as webp. sends the browser to the original image if it can not be resized '''
+
+    url = request.args.get('url', '')
+    width = request.args.get('w', 0, type=int)
+
+    if not image_cache.is_allowed(url):
+        return {'error': 'image host is not allowed'}, 404
+
+    path = image_cache.get(url, width)
+    if not path:
+        return redirect(url)
+
+        # the url names the source image and width, so the variant never changes
+    response = send_file(path, mimetype='image/webp', max_age=IMAGE_MAX_AGE)
+    response.headers['Cache-Control'] += ', immutable'
+    return response
+
+
+@app.template_filter('thumb')
+def thumb(url, width):
+    ''' returns the /img url of an image sized for a slot width pixels wide, the original url if it can not be resized '''
+
+    if not url or not image_cache.enabled or not image_cache.is_allowed(url):
+        return url
+    return url_for('image_variant', url=url, w=image_cache.pick_width(width))
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -279,7 +404,7 @@ def add_to_wishlist(event_id):
         return redirect(url_for('homepage'))
     
 
-    user = User.query.filter_by(username=g.user.username).first()
+    user = g.user
 
         # checks if event is in data base
     existing_event = Event.query.filter_by(event_id=event_id).first()
@@ -287,8 +412,11 @@ def add_to_wishlist(event_id):
         # adds event to data base if not in it
     if not existing_event:
         event = ticketmaster.get_event(event_id)
-        event_to_add = Event(**event)
-        db.session.add(event_to_add)
+
+        if not event:
+            return {'message': 'could not get event'}, 503
+
+        Event.add_events([event])
         db.session.commit()
 
         # adds event to wishlist with users id
@@ -307,7 +435,7 @@ def remove_from_wishlist(event_id):
         flash('You must be logged in to view this page.', 'danger')
         return redirect(url_for('homepage'))
     
-    user = User.query.filter_by(username=g.user.username).first()
+    user = g.user
     item = WishList.query.filter_by(user_id=user.id, event_id=event_id).first()
     db.session.delete(item)
     db.session.commit()
@@ -317,35 +445,47 @@ def remove_from_wishlist(event_id):
 
 @app.route('/get-wishlist')
 def get_wishlist():
-    ''' returns a list of event ids based on users '''
+    ''' returns one page of the users wishlist events. takes after (the next cursor of the page before), limit and when (all, upcoming or past) params, returns the events, the next cursor (None on the last page) and the total for the filter '''
 
     if not g.user:
         flash('You must be logged in to view this page.', 'danger')
         return redirect(url_for('homepage'))
-    
-    user = User.query.filter_by(username=g.user.username).first()
-    wishlist_events = [event.event_id for event in user.wishlist]
 
-    return wishlist_events if wishlist_events else []
+    try:
+        page = get_wishlist_page(g.user)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+        # every event on the page is on the wishlist
+    wishlisted = get_event_ids(page['events'])
+    page['events'] = [event_to_dict(event, wishlisted) for event in page['events']]
+
+    return page
 
 
 @app.route('/user/wishlist')
 def show_wishlist():
-    ''' shows events based on a users wishlist'''
+    ''' shows one page of events on a users wishlist, takes the same params as /get-wishlist '''
 
     if not g.user:
         flash('You must be logged in to view this page.', 'danger')
         return redirect(url_for('homepage'))
     
-    user = User.query.filter_by(username=g.user.username).first()
-    wishlist_events = [event for event in user.wishlist]
+    user = g.user
+
+    try:
+        page = get_wishlist_page(user)
+    except ValueError:
+        flash('Could not find that wishlist page.', 'danger')
+        return redirect(url_for('show_wishlist'))
 
-    wishlist_ids = [event.event_id for event in user.wishlist]
+        # every event on the page is on the wishlist, no second query
+    wishlist_ids = get_event_ids(page['events'])
 
     spot_login = True if session.get('spotify_token', None) else False
     
     
-    return render_template('user-wishlist.html', wishlist=wishlist_events, wishlist_ids=wishlist_ids, user=user, spot_login=spot_login)
+    return render_template('user-wishlist.html', wishlist=page['events'], wishlist_ids=wishlist_ids, next_cursor=page['next'], total=page['total'], limit=page['limit'], when=page['when'], user=user, spot_login=spot_login)
 
 
 # --------------- SPOTIFY FLASK ROUTES ---------------
@@ -384,6 +524,8 @@ def switch_account():
     
     auth_url = spotify.swtich_account()
     if auth_url:
+            # the new account has different top artists, so the callback must not reuse the saved ones
+        session[FORCE_SPOTIFY_REFRESH] = True
         return redirect(auth_url)
     return redirect(url_for('homepage'))
 
@@ -392,73 +534,75 @@ def switch_account():
 def callback():
     ''' call back for the spotify API to redirect to after authentication'''
 
+    if not g.user:
+        flash('You must be logged in to view this page.', 'danger')
+        return redirect(url_for('homepage'))
+
     code = request.args.get('code')
     if code:
-        info = spotify.callback(code)
-
         try:
-            session['spotify_token'] = info
-            access_token = spotify.check_refesh_get_token(token_info=info)
-            headers = {'Authorization': f'Bearer {access_token}'}
+            info = spotify.callback(code)
 
-            top_artists = spotify.get_cur_u_top_artists(headers)
-            session['top_tracks'] = spotify.get_cur_u_top_tracks(headers)
+                # the token is saved for the user, the session only marks spotify as connected for this login
+            spotify_tokens.save(g.user.id, info)
+            session['spotify_token'] = True
 
-            add_artist_to_db(top_artists)
+            headers = spotify_headers(g.user.id)
+            if not headers:
+                raise KeyError('access_token')
+
+            sync_spotify(g.user, headers, force=session.pop(FORCE_SPOTIFY_REFRESH, False))
             return redirect(url_for('homepage'))
         
-        except KeyError:
+        except (KeyError, TypeError):
             flash('Error getting Spotify token info', 'danger')
             return redirect(url_for('homepage'))
+
+            # spotify or ticketmaster failed or answered with something that is not json
+        except (RequestException, ValueError, TicketmasterError, RateLimitError) as e:
+            db.session.rollback()
+            print(f'error connecting spotify: {e}')
+            flash('Could not get your Spotify artists, please try again.', 'danger')
+            return redirect(url_for('homepage'))
         
     flash('Error getting Spotify code from callback', 'danger')
     return redirect(url_for('homepage'))
 
 
 @app.route('/top-artists-events')
+@uses_user('artists')
 def get_top_artists():
-    ''' gets current users top artists events. used to call with front end javascript. groups the events into 2 lists so no artist is on the same list twice'''
+    ''' gets current users top artists events. used to call with front end javascript. groups the events into 2 lists so no artist is on the same list twice. answers from the data base right away with an as_of time and refreshes old events in the background'''
 
     if not g.user:
         flash('You must be logged in to view this page.', 'danger')
         return redirect(url_for('homepage'))
     
-    if not session['spotify_token']:
+    if not session.get('spotify_token', None):
         flash('You must connect Spotify to view this page.', 'danger')
         return redirect(url_for('homepage'))
     
         # gets limit from params
-    limit = request.args.get('limit', 16)
-
-    user = User.query.filter_by(username=g.user.username).first()    
+    limit = request.args.get('limit', 16, type=int)
 
         # creates list of users top artists
-    artists = user.artists
+    artists = g.user_ctx.artists
     if not artists:
-        return None
+        return {'as_of': None, 'refreshing': False, 'events': []}
 
-        # gets all events ordered by date connected to a user
-    user_events = user.events.order_by(Event.date.asc()).limit(limit).all()
-
-    ordered_events = []
-    top_events = []
+        # always answers from the data base, artists with old or missing events are refreshed in the background
+    stale_cutoff = utc_now() - EVENTS_MAX_AGE
+    stale_artists = [artist.id for artist in artists if not artist.events_refreshed_at or artist.events_refreshed_at < stale_cutoff]
+    refreshing = queue_event_refresh(stale_artists) if stale_artists else False
 
-        # if no events already in data base, adds them here 
-    if not user_events:      
-        zipcode = user.zipcode
-        coords = get_lat_long(zipcode)
-        geohash = get_geohash(coords)
-        ticketmaster.add_events_to_db(artists=artists, geohash=geohash)
+        # events are only as fresh as the oldest refreshed artist
+    refreshed_times = [artist.events_refreshed_at for artist in artists if artist.events_refreshed_at]
+    as_of = min(refreshed_times).replace(tzinfo=timezone.utc).isoformat() if refreshed_times else None
 
-        all_events = Event.get_condensed_events(artists)
+    all_events = Event.get_condensed_events(artists, max_events=limit)
 
-        for event_group in all_events:
-            for event in event_group:
-                new_user_event = UserEvent(user_id=user.id, event_id=event.event_id)
-                db.session.add(new_user_event)
-                db.session.commit()
-    elif user_events:
-        all_events = Event.get_condensed_events(artists)
+    ordered_events = []
+    top_events = []
 
     itteration = 0
     looped = False
@@ -484,17 +628,11 @@ def get_top_artists():
                 ordered_events.append(event_group[0])
                 itteration += 1
 
+        # only the shown events are looked up on the wishlist
+    wishlisted = g.user_ctx.wishlisted(get_event_ids(ordered_events))
+
     for event in ordered_events:
-        setup = {
-            'event_id': event.event_id,
-            'name': event.name,
-            'artist': event.artist,
-            'url': event.url,
-            'image': event.image,
-            'date': event.date.strftime('%B %-d, %Y') if event.date else 'TBA',
-            'location': event.location
-        }        
-        top_events.append(setup)
+        top_events.append(event_to_dict(event, wishlisted))
     
     all_top_events = []
     x = 0
@@ -507,7 +645,7 @@ def get_top_artists():
         x += 2
         i += 2
 
-    return all_top_events if all_top_events else None
+    return {'as_of': as_of, 'refreshing': refreshing, 'events': all_top_events}
 
 
 # ==============================================================
@@ -516,13 +654,17 @@ def get_top_artists():
 
 
 def do_login(user):
-    ''' adds user to current user in session'''
+    ''' adds user to current user in session and gives the session a new id'''
 
     session[CUR_U_ID] = user.id
+    regenerate_session()
 
 
 def do_logout():
-    ''' logs out user by deleting all session items'''
+    ''' logs out user by deleting all session items and giving the session a new id'''
+
+        # regenerates first, an empty session is not saved and keeps no id to replace
+    regenerate_session()
 
     if CUR_U_ID in session:
         del session[CUR_U_ID]
@@ -534,59 +676,198 @@ def do_logout():
         del session['top_tracks']
 
 
-def get_lat_long(zipcode):
-    ''' gets latitude and longitute based on zipcode '''
+def regenerate_session():
+    ''' moves the session to a new id and deletes the old one, so a session id from before login or logout can not be reused. the cookie backend has no ids, its cookie changes with its data '''
+
+    regenerate = getattr(app.session_interface, 'regenerate', None)
+    if regenerate:
+        regenerate(session)
+
+
+def get_event_ids(*event_lists):
+    ''' returns the set of event ids in lists of saved events or parsed event dicts '''
+
+    return {event['event_id'] if isinstance(event, dict) else event.event_id for events in event_lists for event in events}
+
+
+def event_to_dict(event, wishlisted):
+    ''' returns a saved event the way the front end javascript uses it. wishlisted is the set of event ids on the users wishlist '''
+
+    return {
+        'event_id': event.event_id,
+        'name': event.name,
+        'artist': event.artist,
+        'url': event.url,
+        'image': event.image,
+        'thumb': thumb(event.image, 640),
+        'date': event.date.strftime('%B %-d, %Y') if event.date else 'TBA',
+        'location': event.location,
+        'wishlisted': event.event_id in wishlisted
+    }
 
-    user = User.query.filter_by(username=g.user.username).first()
-    country_code = user.country_code
 
-    nomi = pgeocode.Nominatim(country_code)
-    data = nomi.query_postal_code(zipcode)
+def get_wishlist_page(user):
+    ''' returns the page of a users wishlist asked for by the after, limit and when params, with the cursor of the next page and the total for the filter. raises ValueError if the cursor or filter is not valid '''
 
-    lat = data.get('latitude', None)
-    long = data.get('longitude', None)
+    after = request.args.get('after') or None
+    limit = min(max(request.args.get('limit', WISHLIST_PAGE_SIZE, type=int), 1), WISHLIST_MAX_PAGE_SIZE)
+    when = request.args.get('when', 'all')
 
-    return (lat, long)
+    events, next_cursor = WishList.get_page(user.id, after=after, limit=limit, when=when)
 
+    return {'events': events, 'next': next_cursor, 'total': WishList.count_events(user.id, when=when), 'limit': limit, 'when': when}
 
-def get_geohash(coords):
-    ''' gets geohash based on lat and long '''
 
-    lat, long = coords
-    geohash = pgh.encode(latitude=lat, longitude=long, precision=9)
+def get_generic_event_groups():
+    ''' returns generic events in groups for the carousel '''
 
-    return geohash
+    generic_events = ticketmaster.get_generic_events(save=True)
+    return [generic_events[0:5], generic_events[5:10], generic_events[10:15], generic_events[15:]]
+
+
+def get_generic_artists():
+    ''' returns the 5 artists shown blurred when spotify is not connected, in one query '''
+
+    return Artist.query.filter(Artist.id.in_(range(1, 6))).order_by(Artist.id).all()
+
+
+def render_generic_homepage(form, csrf_placeholder=False):
+    ''' renders the logged out homepage. csrf_placeholder leaves an empty csrf field for static/app.js to fill in '''
+
+    return render_template('generic-homepage.html', form=form, all_events=get_generic_event_groups(), generic_artists=get_generic_artists(), csrf_placeholder=csrf_placeholder)
+
+
+def cache_page(html):
+    ''' returns a rendered page with its etag for the page cache '''
+
+    return (html, hashlib.sha1(html.encode('utf-8')).hexdigest())
+
+
+def invalidate_page_cache():
+    ''' clears cached pages in this worker, used when something shown on them changes '''
+
+    page_cache.invalidate(everything=True)
+
+
+def queue_event_refresh(artist_ids):
+    ''' queues a background refresh of events for artists not already being refreshed. returns True if a refresh is running for any of them '''
+
+    with refreshing_lock:
+        to_refresh = [artist_id for artist_id in artist_ids if artist_id not in refreshing_artists]
+        refreshing_artists.update(to_refresh)
+
+    if to_refresh:
+        refresh_executor.submit(refresh_artist_events, to_refresh)
+    return True
+
+
+def refresh_artist_events(artist_ids):
+    ''' refreshes events for artists outside of a request, uses its own app context and session '''
+
+    try:
+        with app.app_context():
+            artists = Artist.query.filter(Artist.id.in_(artist_ids)).all()
+            ticketmaster.add_events_to_db(artists)
+            db.session.remove()
+    except Exception as e:
+        print(f'error refreshing artist events: {e}')
+    finally:
+        with refreshing_lock:
+            refreshing_artists.difference_update(artist_ids)
+
+
+def get_user_geohash(user):
+    ''' returns the users saved geohash, geocodes and saves it first for users made before locations were saved '''
+
+    if not user.geohash and user.set_location():
+        db.session.commit()
+    return user.geohash
+
+
+def get_events_near_user(user, limit=20):
+    ''' returns upcoming events near the user. answers from saved events and venues when there are enough of them, otherwise requests ticketmaster '''
+
+    geohash = get_user_geohash(user)
+
+    events = Event.get_near(user.latitude, user.longitude, radius=NEARBY_RADIUS_MILES, limit=limit)
+    if len(events) >= NEARBY_EVENTS_MIN:
+        return events
+
+    return ticketmaster.get_generic_events(geohash=geohash, save=True)
+
+
+def get_spotify_profile(user, headers, force=False):
+    ''' returns the users saved spotify profile and if it was just fetched. uses the saved profile while it is fresh, otherwise requests top artists and top tracks at the same time and adds them to be commited with the users artists '''
+
+    profile = db.session.get(SpotifyProfile, user.id)
+    if profile and not force and profile.is_fresh(SPOTIFY_PROFILE_TTL):
+        return profile, False
+
+    top_artists, top_tracks = spotify.get_cur_u_top(headers)
+    profile = SpotifyProfile.save(user.id, top_artists, top_tracks)
+    return profile, True
+
+
+def spotify_headers(user_id):
+    ''' returns the authorization header for a users spotify token. the token manager refreshes the token first when it is close to expiring. None if spotify is not connected or the refresh failed '''
+
+    access_token = spotify_tokens.get_access_token(user_id)
+    if not access_token:
+        return None
+    return {'Authorization': f'Bearer {access_token}'}
+
+
+def sync_spotify(user, headers, force=False):
+    ''' returns the users spotify profile, fetching it again when it is old. the users artists are saved when the profile was fetched again or they have none, in case an earlier sync failed '''
+
+    profile, fetched = get_spotify_profile(user, headers, force=force)
+
+        # artists only change when the profile was fetched again, the new profile is commited with them
+    if fetched or not g.user_ctx.artists:
+        add_artist_to_db(profile.top_artists)
+        g.user_ctx.reset('artists', 'spotify_profile')
+    return profile
+
+
+def refresh_spotify_profile(user):
+    ''' returns the users saved spotify profile, fetching it and their artists again once it is older than SPOTIFY_PROFILE_TTL. keeps the saved profile if the token can not be refreshed or spotify or ticketmaster fail '''
+
+    profile = g.user_ctx.spotify_profile
+    if profile and profile.is_fresh(SPOTIFY_PROFILE_TTL):
+        return profile
+
+    headers = spotify_headers(user.id)
+    if not headers:
+        return profile
+
+    try:
+        return sync_spotify(user, headers)
+    except (RequestException, ValueError, TicketmasterError, RateLimitError) as e:
+        db.session.rollback()
+        print(f'error refreshing spotify profile: {e}')
+        g.user_ctx.reset('artists', 'spotify_profile')
+        return g.user_ctx.spotify_profile
 
 
 def add_artist_to_db(top_artists):
-    ''' adds artist to database if artist not already there'''
+    ''' saves the users top artists. adds artists not already saved with one statement and only changes the users artists that are new, gone or moved, all in one commit with anything else added to the session like a new spotify profile '''
 
-    u = User.query.filter_by(username=g.user.username).first()
+    u = g.user
+    top_artists = top_artists or []
 
-    if u.artists:
-        UserArtist.query.filter_by(user_id=u.id).delete()
-        
-    artists = ticketmaster.set_up_artists(top_artists)
-
-    for artist in artists:
-        spotify_id = artist.get('spotify_id', None)
-
-        if spotify_id:
-            new_artist = Artist.query.filter_by(spotify_id=spotify_id).first()
-
-            if not new_artist:
-                new_artist = Artist(
-                    name=artist.get('name', 'could not get name'),
-                    spotify_id=artist.get('spotify_id', 'could not get Spotify id'),
-                    spotify_url=artist.get('spotify_url', 'could not get spotify url'),
-                    image=artist.get('image_url', 'could not get image'),
-                    attraction_id=artist.get('attraction_id', 'could not get attraction id')
-                    )
-                
-                db.session.add(new_artist)
-                db.session.commit()
-          
-            new_user_artist = UserArtist(user_id=u.id, artist_id=new_artist.id)
-
-            db.session.add(new_user_artist)
-            db.session.commit()
\ No newline at end of file
+        # spotify rank of each artist, kept even when artists before it have no ticketmaster match
+    spotify_ranks = {}
+    for artist in top_artists:
+        if artist.get('spotify_id', None):
+            spotify_ranks.setdefault(artist['spotify_id'], len(spotify_ranks) + 1)
+
+    artists = ticketmaster.set_up_artists(top_artists) or []
+    artist_ids = Artist.add_artists(artists)
+
+    ranks = {artist_ids[spotify_id]: spotify_ranks[spotify_id] for spotify_id in spotify_ranks if spotify_id in artist_ids}
+    UserArtist.set_user_artists(u.id, ranks)
+    db.session.commit()
+
+        # the logged out homepage shows the first saved artists
+    if any(artist_id <= 5 for artist_id in artist_ids.values()):
+        invalidate_page_cache()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+from event_parser import parse_page, msgspec
+from stub_server import StubData
+
+    # compares the old one event at a time parsing with event_parser on discovery api pages.
+    # run it with: python bench_event_parser.py --events 200 --repeat 5
+
+
+def legacy_create_event(event):
+    ''' the parsing CreateEvent.create_event did before event_parser, kept here to compare against '''
+
+    artist = event.get('_embedded', {}).get('attractions', [{}])[0].get('name', event.get('name', 'could not get artist name'))
+    name = event.get('name', 'could not get artist name')
+    event_id = event.get('id', 'could not get event info')
+    url = event.get('url', 'could not get event url')
+    images = event.get('images', [{}])
+    date = event.get('dates', {}).get('start', {}).get('dateTime', None)
+    locations = event.get('_embedded', {}).get('venues', [{}])[0]
+    city = locations.get('city', {}).get('name', None)
+    state = locations.get('state', {}).get('name', None)
+
+    formatted_date = datetime.fromisoformat(date[:-1]).date() if date else None
+
+    if not city and not state:
+        location = 'TBA'
+    elif not city:
+        location = state
+    elif not state:
+        location = city
+    else:
+        location = f'{city}, {state}'
+
+    cur_biggest = 0
+    for image in images:
+        if int(image.get('width', 0)) >= cur_biggest:
+            cur_biggest = int(image.get('width', 0))
+            image_url = image.get('url')
+
+    return {'artist': artist, 'name': name, 'event_id': event_id, 'url': url, 'image': image_url, 'date': formatted_date, 'location': location}
+
+
+def legacy_parse_page(content):
+    ''' decodes the page with json and parses each event with the old parsing '''
+
+    return [legacy_create_event(event) for event in json.loads(content).get('_embedded', {}).get('events', [])]
+
+
+def make_page(num_events, seed=0):
+    ''' makes a discovery api events page with num_events events. the stub events are padded with the fields real events have so the page is about as big '''
+
+    data = StubData(num_artists=max(num_events // 4, 1), events_per_artist=4, seed=seed)
+    events = []
+
+    for event in data.events[:num_events]:
+        event = json.loads(json.dumps(event))
+        event.update({
+            'test': False,
+            'locale': 'en-us',
+            'sales': {'public': {'startDateTime': '2025-01-10T15:00:00Z', 'startTBD': False, 'endDateTime': '2025-12-01T03:00:00Z'}, 'presales': [{'startDateTime': '2025-01-08T15:00:00Z', 'endDateTime': '2025-01-09T03:00:00Z', 'name': 'Artist Presale'}]},
+            'classifications': [{'primary': True, 'segment': {'id': 'KZFzniwnSyZfZ7v7nJ', 'name': 'Music'}, 'genre': {'id': 'KnvZfZ7vAeA', 'name': 'Rock'}, 'subGenre': {'id': 'KZazBEonSMnZfZ7v6F1', 'name': 'Pop'}}],
+            'promoter': {'id': '494', 'name': 'PROMOTED BY VENUE', 'description': 'PROMOTED BY VENUE / NTL / USA'},
+            'priceRanges': [{'type': 'standard', 'currency': 'USD', 'min': 39.5, 'max': 125.0}],
+            'seatmap': {'staticUrl': 'https://maps.ticketmaster.com/maps/geometry/3/event/00000/staticImage'},
+            'accessibility': {'ticketLimit': 8},
+            'ticketLimit': {'info': 'There is an 8 ticket limit for this event.'},
+            '_links': {'self': {'href': f'/discovery/v2/events/{event["id"]}?locale=en-us'}, 'attractions': [{'href': '/discovery/v2/attractions/K8vZ917?locale=en-us'}], 'venues': [{'href': '/discovery/v2/venues/KovZpZA?locale=en-us'}]}
+        })
+        event['dates'].update({'timezone': 'America/Los_Angeles', 'status': {'code': 'onsale'}, 'spanMultipleDays': False})
+        event['_embedded']['venues'][0].update({'type': 'venue', 'postalCode': '90015', 'timezone': 'America/Los_Angeles', 'country': {'name': 'United States Of America', 'countryCode': 'US'}, 'address': {'line1': '1111 S Figueroa St'}, 'upcomingEvents': {'_total': 120, 'ticketmaster': 118}})
+        events.append(event)
+
+    return json.dumps({'_embedded': {'events': events}, 'page': {'size': num_events, 'totalElements': num_events, 'totalPages': 1, 'number': 0}}).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks parsing Ticketmaster discovery api event pages.')
+    parser.add_argument('--events', type=int, default=200, help='events per page')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=50, help='pages parsed per timing')
+    args = parser.parse_args()
+
+    page = make_page(args.events)
+
+        # every parser has to give the same events as the old parsing
+    expected = legacy_parse_page(page)
+    for use_msgspec in (False, True):
+        parsed = [{key: value for key, value in event.to_dict().items() if key in expected[0]} for event in parse_page(page, use_msgspec=use_msgspec)]
+        assert parsed == expected, 'parsed events do not match the old parsing'
+
+    runs = [('legacy json + CreateEvent', lambda: legacy_parse_page(page)), ('event_parser json', lambda: parse_page(page, use_msgspec=False))]
+    if msgspec:
+        runs.append(('event_parser msgspec', lambda: parse_page(page)))
+    else:
+        print('msgspec is not installed, skipping the msgspec decoder')
+
+    print(f'{args.events} events per page, {len(page) / 1024:.0f} KiB')
+
+    baseline = None
+    for name, run in runs:
+        best = min(timeit.repeat(run, number=args.number, repeat=args.repeat)) / args.number
+        baseline = baseline or best
+        print(f'{name:<28} {best * 1000:8.3f} ms/page  {baseline / best:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    ''' thread safe in memory cache. entries expire after ttl seconds and the least recently used entry is dropped when full '''
+
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+            # one lock per key being filled so a cold key is only computed once
+        self.key_locks = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key, default=None):
+        ''' returns the cached value for a key, default if missing or expired '''
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+
+    def set(self, key, value, ttl=None):
+        ''' saves a value for a key, drops the least recently used entries if full '''
+
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (ttl if ttl is not None else self.ttl))
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def get_or_set(self, key, create, ttl=None):
+        ''' returns the cached value for a key or calls create to make it. only one caller creates a missing key, others wait for it. empty values are not cached '''
+
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+                # another caller may have filled the key while we waited
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[1] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return entry[0]
+
+            try:
+                value = create()
+                if value:
+                    self.set(key, value, ttl=ttl)
+                return value
+            finally:
+                with self.lock:
+                    self.key_locks.pop(key, None)
+
+
+    def invalidate(self, key=None, everything=False):
+        ''' removes one key, or every key if everything is True '''
+
+        with self.lock:
+            if everything:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+    def stats(self):
+        ''' returns hit and miss counts for the cache '''
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'maxsize': self.maxsize
+            }
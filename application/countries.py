@@ -0,0 +1,29 @@
+import json
+import os
+from types import MappingProxyType
+
+    # loaded once when first imported, the path does not depend on the working directory
+COUNTRIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'countries.json')
+
+
+def load_country_codes(file_path=COUNTRIES_PATH):
+    ''' loads file that stores all country codes with each country '''
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+    # country name -> country code
+COUNTRY_CODES = MappingProxyType(load_country_codes())
+
+    # country code -> country name
+COUNTRY_NAMES = MappingProxyType({code: name for name, code in COUNTRY_CODES.items()})
+
+    # (value, label) pairs for the country select fields
+COUNTRY_CHOICES = tuple((name, name) for name in COUNTRY_CODES)
+
+
+def get_country_code(country, default='Code unavailable'):
+    ''' returns the country code for a country name '''
+
+    return COUNTRY_CODES.get(country, default)
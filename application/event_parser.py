@@ -0,0 +1,285 @@
+import json
+from datetime import datetime
+from typing import List, Optional, Union
+
+from geo import get_geohash
+
+    # msgspec is optional, it decodes pages faster and skips every field the parser does not use
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+DEFAULT_IMAGE = 'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTwoFiJiFNFd9HI4Ez177ayXT1aDEejtgyMJA&s'
+
+
+class ParsedEvent:
+    ''' one parsed ticketmaster event with only the fields the app uses. location and venue are built when they are read, so events that are skipped never pay for them '''
+
+    __slots__ = ('artist', 'name', 'event_id', 'url', 'image', 'date', 'city', 'state', 'venue_id', 'venue_name', 'latitude', 'longitude')
+
+    def __init__(self, artist, name, event_id, url, image, date, city, state, venue_id, venue_name, latitude, longitude):
+        self.artist = artist
+        self.name = name
+        self.event_id = event_id
+        self.url = url
+        self.image = image
+        self.date = date
+        self.city = city
+        self.state = state
+        self.venue_id = venue_id
+        self.venue_name = venue_name
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+    @property
+    def location(self):
+        ''' returns "City, State", whichever one there is, or TBA '''
+
+        if self.city and self.state:
+            return f'{self.city}, {self.state}'
+        return self.city or self.state or 'TBA'
+
+
+    @property
+    def venue(self):
+        ''' returns the parsed venue, None if the event has no venue id '''
+
+        if not self.venue_id:
+            return None
+        return parse_venue(self.venue_id, self.venue_name, self.city, self.state, self.latitude, self.longitude)
+
+
+    def to_dict(self):
+        ''' returns the event the same way CreateEvent.create_event does '''
+
+        return {
+            'artist': self.artist,
+            'name': self.name,
+            'event_id': self.event_id,
+            'url': self.url,
+            'image': self.image,
+            'date': self.date,
+            'location': self.location,
+            'venue_id': self.venue_id,
+            'venue': self.venue
+        }
+
+
+class EventParser:
+    ''' parses discovery api events. dates are cached because many events in a page share a start time '''
+
+    def __init__(self):
+        self.dates = {}
+
+
+    def parse_date(self, date):
+        ''' returns the date of an iso date time like 2025-12-01T03:00:00Z, None if there is none '''
+
+        if not date:
+            return None
+
+        parsed = self.dates.get(date)
+        if parsed is None:
+            parsed = self.dates[date] = datetime.fromisoformat(date[:-1]).date()
+        return parsed
+
+
+    def make_event(self, artist, name, event_id, url, image, date, city, state, venue_id, venue_name, lat, long):
+        ''' builds a parsed event from values already read out of the raw event '''
+
+        return ParsedEvent(
+            artist if artist is not None else (name if name is not None else 'could not get artist name'),
+            name if name is not None else 'could not get artist name',
+            event_id if event_id is not None else 'could not get event info',
+            url if url is not None else 'could not get event url',
+            image,
+            self.parse_date(date),
+            city,
+            state,
+            venue_id,
+            venue_name,
+            lat,
+            long
+        )
+
+
+    def parse(self, event):
+        ''' parses one event dict from the discovery api '''
+
+        embedded = event.get('_embedded') or {}
+        attractions = embedded.get('attractions') or [{}]
+        venue = (embedded.get('venues') or [{}])[0]
+        location = venue.get('location') or {}
+
+        return self.make_event(
+            attractions[0].get('name'),
+            event.get('name'),
+            event.get('id'),
+            event.get('url'),
+            widest_image(event.get('images') or []),
+            (event.get('dates') or {}).get('start', {}).get('dateTime'),
+            (venue.get('city') or {}).get('name'),
+            (venue.get('state') or {}).get('name'),
+            venue.get('id'),
+            venue.get('name'),
+            location.get('latitude'),
+            location.get('longitude')
+        )
+
+
+    def parse_struct(self, event):
+        ''' parses one event decoded by msgspec '''
+
+        embedded = event.embedded
+        attraction = embedded.attractions[0] if embedded and embedded.attractions else None
+        venue = embedded.venues[0] if embedded and embedded.venues else None
+        location = venue.location if venue else None
+        start = event.dates.start if event.dates else None
+
+        return self.make_event(
+            attraction.name if attraction else None,
+            event.name,
+            event.id,
+            event.url,
+            widest_image(event.images),
+            start.dateTime if start else None,
+            venue.city.name if venue and venue.city else None,
+            venue.state.name if venue and venue.state else None,
+            venue.id if venue else None,
+            venue.name if venue else None,
+            location.latitude if location else None,
+            location.longitude if location else None
+        )
+
+
+def widest_image(images):
+    ''' returns the url of the widest image, the last one when widths tie '''
+
+    image_url = DEFAULT_IMAGE
+    biggest = 0
+
+    for image in images:
+        if isinstance(image, dict):
+            width, url = image.get('width', 0), image.get('url')
+        else:
+            width, url = image.width, image.url
+
+        width = int(width or 0)
+        if width >= biggest:
+            biggest = width
+            image_url = url or DEFAULT_IMAGE
+    return image_url
+
+
+def parse_venue(venue_id, name, city, state, lat, long):
+    ''' returns a parsed venue, the latitude and longitude are None when ticketmaster does not have them '''
+
+    try:
+        coords = (float(lat), float(long))
+    except (TypeError, ValueError):
+        coords = (None, None)
+
+    return {
+        'id': venue_id,
+        'name': name,
+        'city': city,
+        'state': state,
+        'latitude': coords[0],
+        'longitude': coords[1],
+        'geohash': get_geohash(coords)
+    }
+
+
+def parse_event(event):
+    ''' parses one event dict from the discovery api '''
+
+    return EventParser().parse(event)
+
+
+def parse_events(events):
+    ''' parses a list of event dicts from the discovery api '''
+
+    parser = EventParser()
+    return [parser.parse(event) for event in events]
+
+
+if msgspec:
+        # only the fields the parser reads, msgspec skips the rest of each event without building it
+
+    class _Image(msgspec.Struct):
+        url: Optional[str] = None
+        width: Union[int, float, str, None] = 0
+
+    class _Start(msgspec.Struct):
+        dateTime: Optional[str] = None
+
+    class _Dates(msgspec.Struct):
+        start: Optional[_Start] = None
+
+    class _Name(msgspec.Struct):
+        name: Optional[str] = None
+
+    class _Location(msgspec.Struct):
+        latitude: Union[str, float, None] = None
+        longitude: Union[str, float, None] = None
+
+    class _Venue(msgspec.Struct):
+        id: Optional[str] = None
+        name: Optional[str] = None
+        city: Optional[_Name] = None
+        state: Optional[_Name] = None
+        location: Optional[_Location] = None
+
+    class _EventEmbedded(msgspec.Struct):
+        venues: List[_Venue] = []
+        attractions: List[_Name] = []
+
+    class _Event(msgspec.Struct):
+        id: Optional[str] = None
+        name: Optional[str] = None
+        url: Optional[str] = None
+        images: List[_Image] = []
+        dates: Optional[_Dates] = None
+        embedded: Optional[_EventEmbedded] = msgspec.field(default=None, name='_embedded')
+
+    class _PageEmbedded(msgspec.Struct):
+        events: List[_Event] = []
+
+    class _PageInfo(msgspec.Struct):
+        totalPages: Optional[int] = None
+
+    class _Page(msgspec.Struct):
+        embedded: Optional[_PageEmbedded] = msgspec.field(default=None, name='_embedded')
+        page: Optional[_PageInfo] = None
+
+    _page_decoder = msgspec.json.Decoder(_Page)
+
+
+def parse_page(content, use_msgspec=True):
+    ''' parses a whole discovery api events response, bytes or str, into a list of parsed events. uses msgspec when it is installed and falls back to json if the page does not match the expected shape '''
+
+    return parse_page_info(content, use_msgspec=use_msgspec)[0]
+
+
+def parse_page_info(content, use_msgspec=True):
+    ''' parses a whole discovery api events response, returns (events, total_pages). total_pages is None if the response does not say. raises ValueError if the response is not a json object '''
+
+    parser = EventParser()
+
+    if msgspec and use_msgspec:
+        try:
+            page = _page_decoder.decode(content)
+            events = [parser.parse_struct(event) for event in page.embedded.events] if page.embedded else []
+            return events, page.page.totalPages if page.page else None
+        except (msgspec.ValidationError, msgspec.DecodeError):
+            pass
+
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError('events response is not a json object')
+
+    events = [parser.parse(event) for event in (data.get('_embedded') or {}).get('events') or []]
+    return events, (data.get('page') or {}).get('totalPages')
@@ -2,9 +2,8 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, SelectField
 from wtforms.validators import DataRequired, Email, Length, ValidationError, URL
 
-import pgeocode
-import pandas
-import json
+from geo import is_valid_zipcode
+from countries import COUNTRY_CHOICES, get_country_code
 
 
 class NewUserForm(FlaskForm):
@@ -17,16 +16,9 @@ class NewUserForm(FlaskForm):
 
     @staticmethod
     def get_country_choices():
-        ''' gets all country choices for user signup form'''
+        ''' gets all country choices for user signup form, loaded once at startup'''
 
-        country_choices = []
-
-        data = load_country_codes()
-        keys = list(data.keys())
-        if keys:
-            for key in keys:
-                country_choices.append((key, key))
-        return country_choices
+        return COUNTRY_CHOICES
     
 
     def validate_zipcode(self, zipcode):
@@ -62,16 +54,9 @@ class EditUserForm(FlaskForm):
 
     @staticmethod
     def get_country_choices():
-        ''' gets all country choices for user signup form'''
-
-        country_choices = []
+        ''' gets all country choices for user signup form, loaded once at startup'''
 
-        data = load_country_codes()
-        keys = list(data.keys())
-        if keys:
-            for key in keys:
-                country_choices.append((key, key))
-        return country_choices
+        return COUNTRY_CHOICES
     
 
     def validate_zipcode(self, zipcode):
@@ -106,19 +91,6 @@ class ChangePfpForm(FlaskForm):
 def check_zipcode(zipcode, country):
     ''' checks zipcode is in selected country'''
 
-    load_cc = load_country_codes()
-    cc = load_cc.get(country) 
-    nomi = pgeocode.Nominatim(cc)
-    data = nomi.query_postal_code(zipcode)
-
-    if data is not None and not pandas.isna(data['latitude']) and not pandas.isna(data['longitude']):
-        return True
-    return False
-
-
-def load_country_codes(file_path='data/countries.json'):
-    ''' loads file that stores all country codes with each country '''
-    
-    with open(file_path, 'r') as file:
-        return json.load(file)
+    cc = get_country_code(country, None)
 
+    return is_valid_zipcode(cc, zipcode)
@@ -0,0 +1,227 @@
+import csv
+import math
+import mmap
+import os
+import struct
+import threading
+
+import pgeocode
+import pygeohash as pgh
+
+
+POSTAL_INDEX_DIR = os.environ.get('POSTAL_INDEX_DIR', pgeocode.STORAGE_DIR)
+
+EARTH_RADIUS_MILES = 3958.8
+
+    # (width, height) in miles of one geohash cell at the equator for each precision, cells get narrower away from it
+GEOHASH_CELL_MILES = {
+    1: (3113.0, 3102.0),
+    2: (778.0, 388.0),
+    3: (97.3, 97.0),
+    4: (24.3, 12.1),
+    5: (3.04, 3.04),
+    6: (0.76, 0.38),
+    7: (0.095, 0.095)
+}
+
+
+class PostalIndex:
+    ''' sorted postal codes for one country with their latitude and longitude. read through a memory mapped file so forked workers share the same pages '''
+
+    MAGIC = b'POSTIDX1'
+        # postal code padded to 16 bytes, latitude, longitude
+    RECORD = struct.Struct('<16sdd')
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError(f'{path} is not a postal index')
+
+        self.count = (len(self.mm) - len(self.MAGIC)) // self.RECORD.size
+
+
+    def __len__(self):
+        return self.count
+
+
+    def lookup(self, postal_code):
+        ''' returns (lat, long) for a normalized postal code, None if it is not in the index '''
+
+        key = postal_code.encode('utf-8')
+        if len(key) > 16:
+            return None
+        key = key.ljust(16, b'\0')
+
+        size = self.RECORD.size
+        start = len(self.MAGIC)
+        lo, hi = 0, self.count
+
+            # binary search straight over the mapped records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = start + mid * size
+            code = self.mm[offset:offset + 16]
+
+            if code < key:
+                lo = mid + 1
+            elif code > key:
+                hi = mid
+            else:
+                _, lat, long = self.RECORD.unpack_from(self.mm, offset)
+                return (lat, long)
+        return None
+
+
+    @classmethod
+    def build(cls, country_code, path):
+        ''' builds the index file for a country from the pgeocode postal data, downloads the data the first time '''
+
+        data_path = os.path.join(pgeocode.STORAGE_DIR, f'{country_code}.txt')
+        if not os.path.exists(data_path):
+                # pgeocode downloads and saves the country data once, after that only the saved file is read
+            pgeocode.Nominatim(country_code)
+
+            # averages places that share a postal code the same way pgeocode does
+        totals = {}
+        with open(data_path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                if not row.get('postal_code') or not row.get('latitude') or not row.get('longitude'):
+                    continue
+
+                code = normalize_postal_code(country_code, row['postal_code']).encode('utf-8')
+                if not code or len(code) > 16:
+                    continue
+
+                try:
+                    lat, long = float(row['latitude']), float(row['longitude'])
+                except ValueError:
+                    continue
+
+                total = totals.setdefault(code, [0.0, 0.0, 0])
+                total[0] += lat
+                total[1] += long
+                total[2] += 1
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+
+        with open(tmp_path, 'wb') as file:
+            file.write(cls.MAGIC)
+            for code in sorted(totals):
+                lat, long, count = totals[code]
+                file.write(cls.RECORD.pack(code.ljust(16, b'\0'), lat / count, long / count))
+
+            # replaces in one step so other workers never read a half written file
+        os.replace(tmp_path, path)
+        return cls(path)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_postal_index(country_code):
+    ''' returns the postal index for a country, built once and shared by the whole process. raises ValueError for unknown countries '''
+
+    country_code = (country_code or '').upper()
+    index = _indexes.get(country_code)
+    if index:
+        return index
+
+    if country_code not in pgeocode.COUNTRIES_VALID:
+        raise ValueError(f'{country_code} is not a known country code')
+
+    with _indexes_lock:
+        index = _indexes.get(country_code)
+        if index:
+            return index
+
+        path = os.path.join(POSTAL_INDEX_DIR, f'{country_code}.postal.idx')
+        index = PostalIndex(path) if os.path.exists(path) else PostalIndex.build(country_code, path)
+        _indexes[country_code] = index
+        return index
+
+
+def normalize_postal_code(country_code, postal_code):
+    ''' normalizes a postal code the same way pgeocode does, only the first part is used for GB, IE and CA '''
+
+    code = str(postal_code).strip().upper()
+
+    if country_code in ['GB', 'IE', 'CA']:
+        parts = code.split()
+        code = parts[0] if parts else ''
+    return code
+
+
+def get_lat_long(country_code, zipcode):
+    ''' gets latitude and longitute based on country code and zipcode, returns (None, None) if it cannot be found '''
+
+    country_code = (country_code or '').upper()
+
+    try:
+        index = get_postal_index(country_code)
+
+        # ValueError is an unknown country code, OSError is a failed postal data download
+    except (ValueError, OSError) as e:
+        print(f'Could not get location for {country_code} {zipcode}: {e}')
+        return (None, None)
+
+    coords = index.lookup(normalize_postal_code(country_code, zipcode))
+    return coords if coords else (None, None)
+
+
+def is_valid_zipcode(country_code, zipcode):
+    ''' checks a zipcode exists in a country '''
+
+    return get_lat_long(country_code, zipcode) != (None, None)
+
+
+def get_geohash(coords, precision=9):
+    ''' gets geohash based on lat and long, None if there are no coords '''
+
+    lat, long = coords
+    if lat is None or long is None:
+        return None
+
+    return pgh.encode(latitude=lat, longitude=long, precision=precision)
+
+
+def get_distance(coords1, coords2):
+    ''' returns the distance in miles between two (lat, long) points '''
+
+    lat1, long1 = map(math.radians, coords1)
+    lat2, long2 = map(math.radians, coords2)
+
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def get_nearby_geohashes(coords, radius):
+    ''' returns the geohash cells that cover every point within radius miles of coords. uses the longest precision whose cells are at least radius wide, so the cell holding coords and its 8 neighbours always cover the circle '''
+
+    lat, long = coords
+    width_scale = max(math.cos(math.radians(lat)), 0.01)
+
+    precision = 1
+    for cell_precision, (width, height) in sorted(GEOHASH_CELL_MILES.items()):
+        if min(width * width_scale, height) < radius:
+            break
+        precision = cell_precision
+
+    center = pgh.encode(latitude=lat, longitude=long, precision=precision)
+    cells = {center}
+
+    try:
+        for vertical in (None, 'top', 'bottom'):
+            row = pgh.get_adjacent(center, vertical) if vertical else center
+            cells.update((row, pgh.get_adjacent(row, 'left'), pgh.get_adjacent(row, 'right')))
+
+        # there are no cells past the poles
+    except ValueError:
+        pass
+
+    return sorted(cells)
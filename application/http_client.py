@@ -0,0 +1,124 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HTTPClient:
+    ''' pooled keep alive http client shared by the ticketmaster and spotify classes so connections are reused between calls '''
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, connect_timeout=3.05, read_timeout=10, retries=3, backoff_factor=0.3):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+            # only retries idempotent GETs, POSTs (spotify token calls) are never retried.
+            # 429s are left to the rate limiter so retries are not multiplied
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+
+            # pool_connections is how many hosts are kept, pool_maxsize is how many connections per host
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+            # only retries failed connections and reads, for apis whose 5xx retries go through a rate limiter
+        self.no_status_adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=retry.new(status_forcelist=frozenset()))
+
+        self.no_status_session = requests.Session()
+        self.no_status_session.mount('https://', self.no_status_adapter)
+        self.no_status_session.mount('http://', self.no_status_adapter)
+
+
+    @classmethod
+    def from_env(cls):
+        ''' creates a client using settings from environment variables, falls back to defaults '''
+
+        return cls(
+            pool_connections=int(os.environ.get('HTTP_POOL_CONNECTIONS', 10)),
+            pool_maxsize=int(os.environ.get('HTTP_POOL_MAXSIZE', 10)),
+            pool_block=os.environ.get('HTTP_POOL_BLOCK', 'false').lower() == 'true',
+            connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05)),
+            read_timeout=float(os.environ.get('HTTP_READ_TIMEOUT', 10)),
+            retries=int(os.environ.get('HTTP_RETRIES', 3)),
+            backoff_factor=float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.3))
+        )
+
+
+    def request(self, method, url, retry_status=True, **kwargs):
+        ''' sends a request through the pooled session using the default timeouts if none are passed in. retry_status False returns 5xx responses without retrying them, so the caller can retry them itself '''
+
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        session = self.session if retry_status else self.no_status_session
+        return session.request(method, url, **kwargs)
+
+
+    def get(self, url, retry_status=True, **kwargs):
+        ''' sends a GET request '''
+
+        return self.request('GET', url, retry_status=retry_status, **kwargs)
+
+
+    def post(self, url, **kwargs):
+        ''' sends a POST request '''
+
+        return self.request('POST', url, **kwargs)
+
+
+    def stats(self):
+        ''' returns how many requests were sent, how many new connections were opened and how many requests reused a connection '''
+
+        requests_sent = 0
+        connections_opened = 0
+
+            # each host has its own pool that counts its requests and new connections
+        for adapter in (self.adapter, self.no_status_adapter):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+
+        return {
+            'requests': requests_sent,
+            'connections': connections_opened,
+            'reused': max(requests_sent - connections_opened, 0)
+        }
+
+
+    def close(self):
+        ''' closes all pooled connections '''
+
+        self.session.close()
+        self.no_status_session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    ''' returns the http client for this worker process. a new one is made after a fork so workers never share sockets '''
+
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = HTTPClient.from_env()
+                _client_pid = pid
+    return _client
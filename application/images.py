@@ -0,0 +1,220 @@
+import hashlib
+import io
+import os
+import threading
+from urllib.parse import urlsplit
+
+from http_client import get_http_client
+from cache import TTLCache
+
+    # pillow is optional, without it images are not resized and the original urls are used
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageCache:
+    ''' keeps resized webp copies of event and artist images on local disk. each source image is downloaded once and every width is made from it, the least recently used files are removed once the folder is bigger than max_bytes '''
+
+    def __init__(self, cache_dir, http=None, widths=(160, 320, 640), allowed_hosts=(), max_bytes=256 * 1024 * 1024, max_source_bytes=10 * 1024 * 1024, quality=80, failure_ttl=600, max_failed=1024):
+        self.cache_dir = cache_dir
+        self._http = http
+        self.widths = tuple(sorted(widths))
+            # only images from these hosts and their subdomains are downloaded, so /img can not be used to fetch any url
+        self.allowed_hosts = tuple(host.strip().lower() for host in allowed_hosts if host.strip())
+        self.max_bytes = max_bytes
+        self.max_source_bytes = max_source_bytes
+        self.quality = quality
+            # images that could not be downloaded or read are not tried again for failure_ttl seconds, up to max_failed are remembered
+        self.failed = TTLCache(maxsize=max_failed, ttl=failure_ttl)
+
+            # one lock per image being downloaded, removed once it is done so the dict only holds downloads in progress
+        self.url_locks = {}
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.downloads = 0
+
+
+    @property
+    def http(self):
+        ''' returns the http client passed in, or the shared pooled client for this worker '''
+
+        return self._http or get_http_client()
+
+
+    @property
+    def enabled(self):
+        ''' returns True if pillow is installed and images can be resized '''
+
+        return Image is not None
+
+
+    def is_allowed(self, url):
+        ''' returns True if the url is an http(s) url on one of the allowed hosts '''
+
+        try:
+            parts = urlsplit(url)
+        except (TypeError, ValueError):
+            return False
+
+        host = (parts.hostname or '').lower()
+        if parts.scheme not in ('http', 'https') or not host:
+            return False
+        return any(host == allowed or host.endswith(f'.{allowed}') for allowed in self.allowed_hosts)
+
+
+    def pick_width(self, width):
+        ''' returns the smallest saved width at least as wide as width, the widest one if none are '''
+
+        for saved_width in self.widths:
+            if saved_width >= width:
+                return saved_width
+        return self.widths[-1]
+
+
+    def path(self, url, width):
+        ''' returns where the variant of an image at a width is saved '''
+
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}-{width}.webp')
+
+
+    def get(self, url, width):
+        ''' returns the path of the image resized to the saved width for width, downloading and resizing it the first time. None if it can not be resized '''
+
+        if not self.enabled or not self.is_allowed(url):
+            return None
+
+        path = self.path(url, self.pick_width(width))
+        if self.touch(path):
+            return path
+
+        with self.lock:
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+
+        with url_lock:
+            try:
+                    # another request may have made the variants while this one waited
+                if self.touch(path):
+                    return path
+
+                if self.failed.get(url):
+                    return None
+
+                content = self.download(url)
+                if content is None or not self.save_variants(url, content):
+                    self.failed.set(url, True)
+                    return None
+            finally:
+                with self.lock:
+                    self.url_locks.pop(url, None)
+
+        self.evict()
+        return path if os.path.exists(path) else None
+
+
+    def touch(self, path):
+        ''' marks a saved variant as just used, returns False if it is not saved '''
+
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+
+    def download(self, url):
+        ''' downloads a source image, None if the request fails, it is not an image or it is bigger than max_source_bytes '''
+
+        try:
+                # redirects are not followed so the image can not come from a host that is not allowed
+            with self.http.get(url, stream=True, allow_redirects=False) as response:
+                if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('image/'):
+                    return None
+
+                content = io.BytesIO()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    content.write(chunk)
+                    if content.tell() > self.max_source_bytes:
+                        return None
+        except Exception as e:
+            print(f'error downloading image {url}: {e}')
+            return None
+
+        self.downloads += 1
+        return content.getvalue()
+
+
+    def save_variants(self, url, content):
+        ''' resizes a source image to every width and saves each one as webp, returns False if it can not be read '''
+
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                    # jpegs are decoded at a smaller scale when the widest variant does not need every pixel
+                image.draft('RGB', (self.widths[-1], self.widths[-1]))
+                image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+                for width in self.widths:
+                        # images are never made wider than the source
+                    if width < image.width:
+                        variant = image.resize((width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+                    else:
+                        variant = image
+
+                    output = io.BytesIO()
+                    variant.save(output, 'WEBP', quality=self.quality, method=4)
+                    self.write(self.path(url, width), output.getvalue())
+        except Exception as e:
+            print(f'error resizing image {url}: {e}')
+            return False
+
+        return True
+
+
+    def write(self, path, data):
+        ''' writes a file through a temporary file so other requests never read half of it '''
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += len(data)
+
+
+    def evict(self):
+        ''' removes the least recently used variants until the folder is under 90% of max_bytes. the folder is only read when it may be too big '''
+
+        with self.lock:
+            if self.total_bytes is not None and self.total_bytes <= self.max_bytes:
+                return
+
+            files = []
+            try:
+                with os.scandir(self.cache_dir) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.webp'):
+                            stat = entry.stat()
+                            files.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                pass
+
+            total_bytes = sum(size for _, size, _ in files)
+
+            if total_bytes > self.max_bytes:
+                for _, size, path in sorted(files):
+                    if total_bytes <= self.max_bytes * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total_bytes -= size
+
+                # other workers share the folder, so the total is only a guess until it is read again
+            self.total_bytes = total_bytes
@@ -0,0 +1,90 @@
+from sqlalchemy import inspect, text
+from app import db, app
+from models import User
+
+    # db.create_all only creates missing tables, so columns added to existing tables are added here.
+    # every step checks first so this is safe to run more than once: python migrate.py
+
+
+def has_column(table, column):
+    ''' checks if a table already has a column '''
+
+    return column in [col['name'] for col in inspect(db.engine).get_columns(table)]
+
+
+def add_column(table, column, column_type):
+    ''' adds a column to a table if it is not already there '''
+
+    if not has_column(table, column):
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+        print(f'added {table}.{column}')
+
+
+def backfill_user_locations(batch_size=100):
+    ''' geocodes users saved before locations were stored on the user. users that cannot be geocoded are skipped '''
+
+    last_id = 0
+    updated = 0
+
+    while True:
+        users = User.query.filter(User.geohash.is_(None), User.id > last_id).order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+
+        for user in users:
+            if user.set_location():
+                updated += 1
+        last_id = users[-1].id
+        db.session.commit()
+
+    print(f'saved locations for {updated} users')
+
+
+def backfill_event_artists():
+    ''' links saved events to their artist by the artist name copied from ticketmaster '''
+
+    result = db.session.execute(text('''
+        UPDATE events SET artist_id = (
+            SELECT MIN(artists.id) FROM artists WHERE artists.name = events.artist
+        )
+        WHERE artist_id IS NULL
+        AND EXISTS (SELECT 1 FROM artists WHERE artists.name = events.artist)
+    '''))
+    db.session.commit()
+    print(f'linked {result.rowcount} events to artists')
+
+
+def migrate():
+    ''' runs every migration step in order '''
+
+    add_column('artists', 'events_refreshed_at', 'TIMESTAMP')
+
+    add_column('users', 'latitude', 'DOUBLE PRECISION')
+    add_column('users', 'longitude', 'DOUBLE PRECISION')
+    add_column('users', 'geohash', 'TEXT')
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_users_geohash ON users (geohash)'))
+    db.session.commit()
+    backfill_user_locations()
+
+    add_column('events', 'artist_id', 'INTEGER REFERENCES artists (id) ON DELETE SET NULL')
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_events_artist_id_date ON events (artist_id, date)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_users_events_event_id ON users_events (event_id)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_wishlist_event_id ON wishlist (event_id)'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_users_artists_artist_id ON users_artists (artist_id)'))
+    db.session.commit()
+    backfill_event_artists()
+
+        # the venues table itself is made by db.create_all, events saved before it get their venue on the next refresh
+    add_column('events', 'venue_id', 'TEXT REFERENCES venues (id) ON DELETE SET NULL')
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_events_venue_id_date ON events (venue_id, date)'))
+    db.session.commit()
+
+        # existing rows keep a NULL rank until the user next connects spotify
+    add_column('users_artists', 'rank', 'INTEGER')
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        migrate()
+        db.session.commit()
@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta, date
 from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects import postgresql, sqlite
+from geo import get_lat_long, get_geohash, get_distance, get_nearby_geohashes
 
-import json
+from countries import get_country_code
+from event_parser import parse_event, parse_venue
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -23,9 +26,13 @@ class User(db.Model):
     zipcode = db.Column(db.Text, nullable=False)
     bio = db.Column(db.Text, nullable=True)
     profile_img = db.Column(db.Text, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.Text, nullable=True, index=True)
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
 
-    artists = db.relationship('Artist', secondary='users_artists', backref='users', lazy='dynamic')
+        # in the users spotify order
+    artists = db.relationship('Artist', secondary='users_artists', backref='users', lazy='dynamic', order_by='UserArtist.rank')
 
     events = db.relationship('Event', secondary='users_events', backref='users', lazy='dynamic')
 
@@ -36,8 +43,7 @@ class User(db.Model):
     def signup(cls, name, username, email, password, country, zipcode, bio, profile_img):
         ''' method to signup user. gets country code based on country, hashes password and adds user to be commited'''
 
-        country_codes = load_country_codes()
-        code = country_codes.get(country, 'Code unavailable')
+        code = get_country_code(country)
         hashed_pswd = bcrypt.generate_password_hash(password).decode('UTF-8')
 
         user = User(
@@ -51,8 +57,18 @@ class User(db.Model):
             bio=bio,
             profile_img=profile_img
         )
+        user.set_location()
         db.session.add(user)
         return user
+
+
+    def set_location(self):
+        ''' geocodes the users zipcode once and saves the latitude, longitude and geohash so requests never have to '''
+
+        coords = get_lat_long(self.country_code, self.zipcode)
+        self.latitude, self.longitude = coords
+        self.geohash = get_geohash(coords)
+        return self.geohash
     
 
     @classmethod
@@ -72,12 +88,13 @@ class User(db.Model):
     def update_details(cls, user_id, name, username, email, country, zipcode, bio):
         ''' method to update user details. gets country code based on country, gets user from data base and updates info '''
 
-        country_codes = load_country_codes()
-        code = country_codes.get(country, 'Code unavailable')
+        code = get_country_code(country)
 
         user = cls.query.filter_by(id=user_id).first()
 
         if user:
+            location_changed = user.country_code != code or user.zipcode != zipcode
+
             user.name = name
             user.username = username
             user.email = email
@@ -85,6 +102,10 @@ class User(db.Model):
             user.country_code = code
             user.zipcode = zipcode
             user.bio = bio       
+
+                # only geocodes again if the location changed
+            if location_changed or not user.geohash:
+                user.set_location()
             return user
         return False
 
@@ -113,6 +134,83 @@ class User(db.Model):
         return False
     
 
+class SpotifyToken(db.Model):
+    ''' creates a spotify tokens table to keep each users spotify token so it can be refreshed once and shared by every worker '''
+
+    __tablename__ = 'spotify_tokens'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    access_token = db.Column(db.Text, nullable=False)
+    refresh_token = db.Column(db.Text, nullable=True)
+    scope = db.Column(db.Text, nullable=True)
+        # unix time in seconds, the same as expires_at in the token info
+    expires_at = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: utc_now())
+
+
+    def to_info(self):
+        ''' returns the token the same way the spotify class returns token info '''
+
+        return {
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'scope': self.scope,
+            'expires_at': self.expires_at
+        }
+
+
+    @classmethod
+    def save(cls, user_id, token_info, session=None):
+        ''' method to save a users token info, keeps the old refresh token if spotify did not send a new one. adds token to be commited to session, the request session if none is passed in '''
+
+        session = session or db.session
+        token = session.get(cls, user_id)
+
+        if not token:
+            token = cls(user_id=user_id)
+            session.add(token)
+
+        token.access_token = token_info['access_token']
+        token.refresh_token = token_info.get('refresh_token') or token.refresh_token
+        token.scope = token_info.get('scope', token.scope)
+        token.expires_at = int(token_info['expires_at'])
+        token.updated_at = utc_now()
+        return token
+
+
+class SpotifyProfile(db.Model):
+    ''' creates a spotify profiles table to keep each users parsed top artists and top tracks so they are not requested from spotify on every connect '''
+
+    __tablename__ = 'spotify_profiles'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    top_artists = db.Column(db.JSON, nullable=True)
+    top_tracks = db.Column(db.JSON, nullable=True)
+    fetched_at = db.Column(db.DateTime, nullable=False, default=lambda: utc_now())
+
+
+    def is_fresh(self, ttl):
+        ''' checks if the profile was fetched within ttl '''
+
+        return self.fetched_at + ttl > utc_now()
+
+
+    @classmethod
+    def save(cls, user_id, top_artists, top_tracks):
+        ''' method to save a users parsed top artists and top tracks. adds profile to be commited '''
+
+        profile = db.session.get(cls, user_id)
+
+        if not profile:
+            profile = cls(user_id=user_id)
+            db.session.add(profile)
+
+        profile.top_artists = top_artists
+        profile.top_tracks = top_tracks
+        profile.fetched_at = utc_now()
+        return profile
+
+
 class Artist(db.Model):
     ''' creates an artists table to store artist data'''
 
@@ -124,25 +222,185 @@ class Artist(db.Model):
     spotify_url = db.Column(db.Text, nullable=False, unique=True)
     image = db.Column(db.Text, nullable=True)
     attraction_id = db.Column(db.Text, nullable=False, unique=True)
+    events_refreshed_at = db.Column(db.DateTime, nullable=True)
+
+
+    @classmethod
+    def get_stale(cls, max_age, limit=None):
+        ''' method to get artists whose events have not been refreshed within max_age, most followed artists first '''
+
+        followers = db.func.count(UserArtist.user_id)
+
+        query = (
+            db.session.query(cls)
+            .outerjoin(UserArtist, UserArtist.artist_id == cls.id)
+            .filter(db.or_(cls.events_refreshed_at.is_(None), cls.events_refreshed_at < utc_now() - max_age))
+            .group_by(cls.id)
+            .order_by(followers.desc(), cls.events_refreshed_at.asc().nullsfirst(), cls.id)
+        )
+
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+
+    @classmethod
+    def add_artists(cls, artists):
+        ''' method to add a batch of set up artists with one statement, artists already saved get their name and image updated. adds them to be commited, returns a dict of spotify id to artist id '''
+
+        rows = {}
+        for artist in artists:
+            spotify_id = artist.get('spotify_id', None)
+            if not spotify_id:
+                continue
+
+            rows.setdefault(spotify_id, {
+                'name': artist.get('name', 'could not get name'),
+                'spotify_id': spotify_id,
+                'spotify_url': artist.get('spotify_url', 'could not get spotify url'),
+                'image': artist.get('image_url', 'could not get image'),
+                'attraction_id': artist.get('attraction_id', 'could not get attraction id')
+            })
+
+        if not rows:
+            return {}
+
+        db.session.execute(upsert(cls, ['spotify_id'], ['name', 'image']), list(rows.values()))
+
+        return {spotify_id: artist_id for artist_id, spotify_id in db.session.query(cls.id, cls.spotify_id).filter(cls.spotify_id.in_(rows.keys()))}
+
+
+class AttractionLookup(db.Model):
+    ''' creates an attraction lookups table to remember which ticketmaster attraction id belongs to a spotify artist. attraction_id is empty when ticketmaster does not know the artist '''
+
+    __tablename__ = 'attraction_lookups'
+
+    spotify_id = db.Column(db.Text, primary_key=True)
+    spotify_url = db.Column(db.Text, nullable=True, index=True)
+    attraction_id = db.Column(db.Text, nullable=True)
+    resolved_at = db.Column(db.DateTime, nullable=False, default=lambda: utc_now())
+
+        # matches barely ever change, misses are checked again sooner in case ticketmaster adds the artist
+    FOUND_TTL = timedelta(days=30)
+    MISSING_TTL = timedelta(days=1)
+
+
+    @property
+    def is_fresh(self):
+        ''' checks if the lookup is still inside its ttl, misses use the shorter ttl '''
+
+        ttl = self.FOUND_TTL if self.attraction_id else self.MISSING_TTL
+        return self.resolved_at + ttl > utc_now()
+    
+
+    @classmethod
+    def get_fresh(cls, spotify_ids):
+        ''' method to get all fresh lookups for a list of spotify ids in one query. returns a dict of spotify id to lookup '''
+
+        if not spotify_ids:
+            return {}
+
+        lookups = cls.query.filter(cls.spotify_id.in_(spotify_ids)).all()
+        return {lookup.spotify_id: lookup for lookup in lookups if lookup.is_fresh}
+    
+
+    @classmethod
+    def record(cls, spotify_id, spotify_url, attraction_id):
+        ''' method to save the result of an attraction lookup, a None attraction id saves a miss. adds lookup to be commited '''
+
+        lookup = db.session.get(cls, spotify_id)
+
+        if not lookup:
+            lookup = cls(spotify_id=spotify_id)
+            db.session.add(lookup)
+
+        lookup.spotify_url = spotify_url
+        lookup.attraction_id = attraction_id
+        lookup.resolved_at = utc_now()
+        return lookup
 
 
 class UserArtist(db.Model):
     ''' creates a user artists table to connect users top artists to users'''
 
     __tablename__ = 'users_artists'
+    __table_args__ = (db.Index('ix_users_artists_artist_id', 'artist_id'),)
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
 
     artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True)
 
+        # the artists position in the users spotify top artists, 1 is their top artist
+    rank = db.Column(db.Integer, nullable=True)
+
+
+    @classmethod
+    def set_user_artists(cls, user_id, ranks):
+        ''' method to make a users artists match ranks, a dict of artist id to spotify rank. only deletes, adds or re ranks the rows that changed. adds changes to be commited, returns (added, removed, reranked) '''
+
+        current = {artist_id: rank for artist_id, rank in db.session.query(cls.artist_id, cls.rank).filter(cls.user_id == user_id)}
+
+        removed = [artist_id for artist_id in current if artist_id not in ranks]
+        added = [{'user_id': user_id, 'artist_id': artist_id, 'rank': rank} for artist_id, rank in ranks.items() if artist_id not in current]
+        reranked = [{'rank_artist_id': artist_id, 'new_rank': rank} for artist_id, rank in ranks.items() if artist_id in current and current[artist_id] != rank]
+
+        if removed:
+            cls.query.filter(cls.user_id == user_id, cls.artist_id.in_(removed)).delete(synchronize_session=False)
+
+        if added:
+            db.session.execute(insert_ignore(cls, ['user_id', 'artist_id']), added)
+
+        if reranked:
+            table = cls.__table__
+            db.session.execute(
+                table.update().where(table.c.user_id == user_id, table.c.artist_id == db.bindparam('rank_artist_id')).values(rank=db.bindparam('new_rank')),
+                reranked
+            )
+
+        return (len(added), len(removed), len(reranked))
+
+
+class Venue(db.Model):
+    ''' creates a venues table to store where events are held. the geohash index is used for prefix searches of nearby venues '''
+
+    __tablename__ = 'venues'
+        # text_pattern_ops lets postgres use the index for LIKE 'prefix%' in any collation
+    __table_args__ = (db.Index('ix_venues_geohash', 'geohash', postgresql_ops={'geohash': 'text_pattern_ops'}),)
+
+    id = db.Column(db.Text, primary_key=True)
+    name = db.Column(db.Text, nullable=True)
+    city = db.Column(db.Text, nullable=True)
+    state = db.Column(db.Text, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.Text, nullable=True)
+
+
+    @classmethod
+    def add_venues(cls, venues):
+        ''' method to add a batch of parsed venues, skipping any already in the data base. adds them to be commited '''
+
+        unique_venues = {}
+        for venue in venues:
+            if venue and venue.get('id'):
+                unique_venues.setdefault(venue['id'], venue)
+
+        if unique_venues:
+            db.session.execute(insert_ignore(cls, ['id']), list(unique_venues.values()))
+        return len(unique_venues)
+
 
 class Event(db.Model):
     ''' creates a events table to store info about events '''
     __tablename__ = 'events'
+        # per artist upcoming event queries only read these indexes
+    __table_args__ = (db.Index('ix_events_artist_id_date', 'artist_id', 'date'), db.Index('ix_events_venue_id_date', 'venue_id', 'date'))
 
     event_id = db.Column(db.Text, nullable=False, unique=True, primary_key=True)
     name = db.Column(db.Text, nullable=False)
     artist = db.Column(db.Text, nullable=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='SET NULL'), nullable=True)
+    venue_id = db.Column(db.Text, db.ForeignKey('venues.id', ondelete='SET NULL'), nullable=True)
     url = db.Column(db.Text, nullable=False)
     image = db.Column(db.Text, nullable=False)
     date = db.Column(db.Date, nullable=True)
@@ -157,31 +415,141 @@ class Event(db.Model):
     
 
     @classmethod
-    def get_condensed_events(cls, artists, max_events=16):
-        ''' method to return a condensed list of events from top artists, up to 16. orders them by 2 events per artist '''
+    def get_condensed_events(cls, artists, max_events=16, per_artist=2, upcoming_only=True):
+        ''' method to return a condensed list of events from top artists, up to max_events in total and per_artist for each artist. every artists first event is kept before any artists second one, so the total limit never drops an artist while others have more than one event. gets every artists events in one query and groups them by artist in the same order as the artists '''
 
-        events = []
-        artist_names = [artist.name for artist in artists]
+            # keeps the artist order and drops repeated artists
+        artist_ids = list(dict.fromkeys(artist.id for artist in artists if artist.id))
+        if not artist_ids:
+            return []
 
-        for artist in artist_names:
-            if len(events) >= max_events:
-                break
-                
-                # gets only 2 events per artist
-            event = Event.query.filter_by(artist=artist).order_by(Event.date.asc()).limit( 2).all()
+        filters = [cls.artist_id.in_(artist_ids)]
+        if upcoming_only:
+            filters.append(db.or_(cls.date.is_(None), cls.date >= date.today()))
+
+            # events without a date (TBA) go after dated ones like postgres orders them
+        order = (cls.date.is_(None), cls.date.asc(), cls.event_id)
+
+        if supports_window_functions():
+                # numbers each artists events by date and keeps the first per_artist of them
+            row_num = db.func.row_number().over(partition_by=cls.artist_id, order_by=order).label('row_num')
+            ranked = db.session.query(cls.event_id, row_num).filter(*filters).subquery()
+
+            events = cls.query.join(ranked, ranked.c.event_id == cls.event_id).filter(ranked.c.row_num <= per_artist).order_by(*order).all()
+        else:
+            events = []
+            for artist_id in artist_ids:
+                events.extend(cls.query.filter(cls.artist_id == artist_id, *filters).order_by(*order).limit(per_artist).all())
+
+        events_by_artist = {}
+        for event in events:
+            events_by_artist.setdefault(event.artist_id, []).append(event)
+
+            # takes one event from each artist per round until max_events are kept
+        kept = dict.fromkeys(artist_ids, 0)
+        total = 0
+
+        for position in range(per_artist):
+            for artist_id in artist_ids:
+                if total >= max_events:
+                    break
+
+                if len(events_by_artist.get(artist_id, [])) > position:
+                    kept[artist_id] += 1
+                    total += 1
+
+        return [events_by_artist[artist_id][:kept[artist_id]] for artist_id in artist_ids if kept[artist_id]]
+
+
+    @classmethod
+    def get_near(cls, latitude, longitude, radius=50, limit=20, upcoming_only=True, unique_artists=True, max_candidates=1000):
+        ''' method to get events at venues within radius miles, soonest first. venues are narrowed down by geohash prefix and then by exact distance. unique_artists keeps only the first event for each artist '''
+
+        if latitude is None or longitude is None:
+            return []
+
+        cells = get_nearby_geohashes((latitude, longitude), radius)
+
+        query = cls.query.join(Venue, Venue.id == cls.venue_id).filter(db.or_(*[Venue.geohash.like(f'{cell}%') for cell in cells]))
+        if upcoming_only:
+            query = query.filter(db.or_(cls.date.is_(None), cls.date >= date.today()))
+
+            # events without a date (TBA) go last
+        candidates = query.add_columns(Venue.latitude, Venue.longitude).order_by(cls.date.is_(None), cls.date.asc(), cls.event_id).limit(max_candidates).all()
 
-            if not event:
+        events = []
+        seen_artists = set()
+
+        for event, venue_lat, venue_long in candidates:
+                # the prefix cells cover a square, this drops the corners
+            if get_distance((latitude, longitude), (venue_lat, venue_long)) > radius:
                 continue
 
+            if unique_artists:
+                artist = event.artist_id or event.artist
+                if artist in seen_artists:
+                    continue
+                seen_artists.add(artist)
+
             events.append(event)
-        
+            if len(events) >= limit:
+                break
+
         return events
     
 
+    @classmethod
+    def add_events(cls, events):
+        ''' method to add a batch of parsed events, skipping any already in the data base. saves their venues first, finds existing events with one query and inserts the rest with one statement, adds them to be commited. returns how many were new '''
+
+            # drops duplicate events in the batch, keeps the first one
+        unique_events = {}
+        venues = []
+        for event in events:
+            event = dict(event)
+            venues.append(event.pop('venue', None))
+            unique_events.setdefault(event['event_id'], event)
+
+        if not unique_events:
+            return 0
+
+            # venues have to be saved before the events that reference them
+        Venue.add_venues(venues)
+
+        existing_ids = {event_id for (event_id,) in db.session.query(cls.event_id).filter(cls.event_id.in_(unique_events.keys()))}
+        new_events = [event for event_id, event in unique_events.items() if event_id not in existing_ids]
+
+            # links saved events that were added without an artist, like events added from a wishlist
+        to_link = [{'link_event_id': event_id, 'link_artist_id': event['artist_id']} for event_id, event in unique_events.items() if event_id in existing_ids and event.get('artist_id')]
+        if to_link:
+            table = cls.__table__
+            db.session.execute(
+                table.update().where(table.c.event_id == db.bindparam('link_event_id'), table.c.artist_id.is_(None)).values(artist_id=db.bindparam('link_artist_id')),
+                to_link
+            )
+
+            # same for events saved before venues were
+        to_link = [{'link_event_id': event_id, 'link_venue_id': event['venue_id']} for event_id, event in unique_events.items() if event_id in existing_ids and event.get('venue_id')]
+        if to_link:
+            table = cls.__table__
+            db.session.execute(
+                table.update().where(table.c.event_id == db.bindparam('link_event_id'), table.c.venue_id.is_(None)).values(venue_id=db.bindparam('link_venue_id')),
+                to_link
+            )
+
+        if not new_events:
+            return 0
+
+            # on conflict do nothing covers events added by another worker after the select above
+        db.session.execute(insert_ignore(cls, ['event_id']), new_events)
+        return len(new_events)
+    
+
 class UserEvent(db.Model):
     ''' creates a user events table to connect a user to specific events'''
 
     __tablename__ = 'users_events'
+    __table_args__ = (db.Index('ix_users_events_event_id', 'event_id'),)
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
 
@@ -192,14 +560,103 @@ class WishList(db.Model):
     ''' creates a wishlist table to connect a user to events added to wishlist'''
 
     __tablename__ = 'wishlist'
+    __table_args__ = (db.Index('ix_wishlist_event_id', 'event_id'),)
 
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
 
     event_id = db.Column(db.Text, db.ForeignKey('events.event_id', ondelete='CASCADE'), primary_key=True)   
+
+
+        # upcoming events are from today on and include TBA events, past events all have a date
+    WHEN_FILTERS = ('all', 'upcoming', 'past')
+        # events without a date (TBA) sort as if they were on the last possible date
+    TBA_SORT_DATE = date.max
+
+
+    @classmethod
+    def when_filters(cls, when):
+        ''' method to return the event filters for all, upcoming or past wishlist events '''
+
+        if when not in cls.WHEN_FILTERS:
+            raise ValueError(f'unknown wishlist filter {when}')
+
+        if when == 'upcoming':
+            return [db.or_(Event.date.is_(None), Event.date >= date.today())]
+        if when == 'past':
+            return [Event.date < date.today()]
+        return []
+
+
+    @classmethod
+    def get_page(cls, user_id, after=None, limit=20, when='all'):
+        ''' method to return one page of a users wishlist events ordered by (date, event id), TBA events last. past events are newest first. after is the cursor of the last event on the page before, so pages never skip rows with an offset. returns (events, cursor for the next page or None) '''
+
+        sort_date = db.func.coalesce(Event.date, cls.TBA_SORT_DATE)
+        newest_first = when == 'past'
+
+        query = Event.query.join(cls, cls.event_id == Event.event_id).filter(cls.user_id == user_id, *cls.when_filters(when))
+
+        if after:
+            after_date, after_id = cls.parse_cursor(after)
+            if newest_first:
+                query = query.filter(db.or_(sort_date < after_date, db.and_(sort_date == after_date, Event.event_id < after_id)))
+            else:
+                query = query.filter(db.or_(sort_date > after_date, db.and_(sort_date == after_date, Event.event_id > after_id)))
+
+        order = (sort_date.desc(), Event.event_id.desc()) if newest_first else (sort_date.asc(), Event.event_id.asc())
+
+            # one extra row says if there is a next page without counting
+        events = query.order_by(*order).limit(limit + 1).all()
+
+        if len(events) > limit:
+            return events[:limit], cls.make_cursor(events[limit - 1])
+        return events, None
+
+
+    @classmethod
+    def count_events(cls, user_id, when='all'):
+        ''' method to return how many events are on a users wishlist. all only reads the wishlist primary key, upcoming and past also read each events date '''
+
+        query = db.session.query(db.func.count()).select_from(cls).filter(cls.user_id == user_id)
+
+        filters = cls.when_filters(when)
+        if filters:
+            query = query.join(Event, Event.event_id == cls.event_id).filter(*filters)
+
+        return query.scalar()
+
+
+    @classmethod
+    def get_wishlisted(cls, user_id, event_ids):
+        ''' method to return which of the given event ids are on a users wishlist, only those ids are looked up '''
+
+        event_ids = list(set(event_ids))
+        if not event_ids:
+            return set()
+
+        return {event_id for (event_id,) in db.session.query(cls.event_id).filter(cls.user_id == user_id, cls.event_id.in_(event_ids))}
+
+
+    @classmethod
+    def make_cursor(cls, event):
+        ''' method to return the cursor of an event, its sort date and event id '''
+
+        return f'{(event.date or cls.TBA_SORT_DATE).isoformat()}_{event.event_id}'
+
+
+    @staticmethod
+    def parse_cursor(cursor):
+        ''' method to return the (date, event id) in a cursor, raises ValueError if it is not one '''
+
+        cursor_date, separator, event_id = cursor.partition('_')
+        if not separator or not event_id:
+            raise ValueError(f'invalid wishlist cursor {cursor}')
+
+        return date.fromisoformat(cursor_date), event_id
     
 
 class CreateEvent():
-    ''' regualr python class to create a new event. simplifies data to only what is needed'''
+    ''' regualr python class to create a new event. simplifies data to only what is needed. parsing is done by event_parser, which can also parse a whole page at once'''
 
     def __init__(self, event):
         self.event = event
@@ -208,50 +665,17 @@ class CreateEvent():
     def create_event(self):
         ''' creates event with parsed data '''
 
-        artist = self.event.get('_embedded', {}).get('attractions', [{}])[0].get('name', self.event.get('name', 'could not get artist name'))
-        name = self.event.get('name', 'could not get artist name')
-        event_id = self.event.get('id', 'could not get event info')
-        url = self.event.get('url', 'could not get event url')
-        images = self.event.get('images', [{}])
-        date = self.event.get('dates', {}).get('start', {}).get('dateTime', None)
-        locations = self.event.get('_embedded', {}).get('venues', [{}])[0]
-        city = locations.get('city', {}).get('name', None)
-        state = locations.get('state', {}).get('name', None)
-
-        if date:
-                # formats date if there is a date
-            formatted_date = datetime.fromisoformat(date[:-1]).date()
-        else:
-            formatted_date = None
-
-        if not city and not state:
-            location = 'TBA'
-        elif not city:
-            location = state
-        elif not state:
-            location = city
-        elif city and state:
-            location = f'{city}, {state}'
-            
-        cur_biggest = 0
-
-            # finds the image with the biggest resolution
-        for image in images:
-            if int(image.get('width', 0)) >= cur_biggest:
-                cur_biggest = int(image.get('width', 0))
-                image_url = image.get('url', 'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcTwoFiJiFNFd9HI4Ez177ayXT1aDEejtgyMJA&s')
-            else:
-                continue
+        return parse_event(self.event).to_dict()
+    
 
-        return {
-            'artist': artist,
-            'name': name,
-            'event_id': event_id,
-            'url': url,
-            'image': image_url,
-            'date': formatted_date,
-            'location': location
-        }
+    def create_venue(self, venue, city, state):
+        ''' creates venue with parsed data, None if the venue has no id '''
+
+        if not venue.get('id', None):
+            return None
+
+        location = venue.get('location', {})
+        return parse_venue(venue['id'], venue.get('name', None), city, state, location.get('latitude'), location.get('longitude'))
 
 
 def connect_db(app):
@@ -259,9 +683,40 @@ def connect_db(app):
     db.init_app(app)
 
 
-def load_country_codes(file_path='data/countries.json'):
-    ''' loads file that stores all country codes with each country '''
-    
-    with open(file_path, 'r') as file:
-        return json.load(file)
+def insert_ignore(model, conflict_columns):
+    ''' returns an insert for a model that skips rows which conflict on the given columns. uses ON CONFLICT DO NOTHING on postgres and sqlite '''
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=conflict_columns)
+    return db.insert(model)
+
+
+def upsert(model, conflict_columns, update_columns):
+    ''' returns an insert for a model that updates update_columns on rows which conflict on the given columns. uses ON CONFLICT DO UPDATE on postgres and sqlite '''
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert(model) if dialect == 'postgresql' else sqlite.insert(model)
+        return insert.on_conflict_do_update(index_elements=conflict_columns, set_={column: insert.excluded[column] for column in update_columns})
+    return db.insert(model)
+
+
+def supports_window_functions():
+    ''' checks the data base supports window functions, sqlite only has them from 3.25 '''
+
+    dialect = db.session.get_bind().dialect
+
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 25)
+    return True
+
+
+def utc_now():
+    ''' returns the current utc time without tzinfo so it compares with times read back from the data base '''
 
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class RateLimitError(Exception):
+    ''' raised when the daily quota is used up or a request is still rate limited after all retries '''
+
+
+class RateLimiter:
+    ''' thread safe token bucket that paces requests to an api and tracks the daily quota from the rate limit response headers '''
+
+    def __init__(self, rate=5, burst=None, daily_quota=5000, max_retries=4, backoff_base=0.5, backoff_cap=8, max_retry_after=10):
+        self.rate = rate
+        self.burst = burst or rate
+        self.daily_quota = daily_quota
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+            # a Retry-After longer than this is not waited for, the request thread would be blocked too long
+        self.max_retry_after = max_retry_after
+
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+
+            # None until the first response tells us the real numbers
+        self.quota_remaining = None
+        self.quota_reset_at = None
+        self.throttled = 0
+
+        self.lock = threading.Lock()
+
+
+    @property
+    def remaining_quota(self):
+        ''' returns how many requests are left for the day, None if no response has been seen yet '''
+
+        with self.lock:
+            return self.quota_remaining
+
+
+    def acquire(self):
+        ''' blocks until a request can be sent. raises RateLimitError if the daily quota is used up '''
+
+        while True:
+            with self.lock:
+                if self.quota_remaining is not None and self.quota_remaining <= 0:
+                    if self.quota_reset_at is None or time.time() >= self.quota_reset_at:
+                            # quota has reset (or we do not know when), the next response will tell us the new count
+                        self.quota_remaining = None
+                    else:
+                        raise RateLimitError('Daily quota used up')
+
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    if self.quota_remaining is not None:
+                        self.quota_remaining -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+    def update_from_headers(self, headers):
+        ''' updates the daily quota from the Rate-Limit-Available and Rate-Limit-Reset headers '''
+
+        available = headers.get('Rate-Limit-Available')
+        limit = headers.get('Rate-Limit')
+        reset = headers.get('Rate-Limit-Reset')
+
+        with self.lock:
+            if limit and limit.isdigit():
+                self.daily_quota = int(limit)
+            if available and available.isdigit():
+                self.quota_remaining = int(available)
+            if reset and reset.isdigit():
+                    # ticketmaster sends the reset time in milliseconds
+                self.quota_reset_at = int(reset) / 1000
+
+
+    def backoff(self, attempt, retry_after=None):
+        ''' returns how long to wait before retrying a rate limited request. uses exponential backoff with jitter and never less than Retry-After. raises RateLimitError if Retry-After is longer than max_retry_after '''
+
+        with self.lock:
+            self.throttled += 1
+
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        wait = parse_retry_after(retry_after)
+
+        if wait is not None:
+            if wait > self.max_retry_after:
+                raise RateLimitError(f'Retry-After of {wait:.0f}s is longer than {self.max_retry_after}s')
+            delay = max(delay, wait + random.uniform(0, self.backoff_base))
+        return delay
+
+
+def parse_retry_after(value):
+    ''' parses a Retry-After header which is either seconds or an http date, returns seconds to wait or None '''
+
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,67 @@
+import argparse
+import time
+from datetime import timedelta
+
+from models import Artist, utc_now
+from app import db, app, ticketmaster
+
+    # refreshes events for every tracked artist so request handlers only have to read from the data base.
+    # run once from cron:       python refresh_events.py --once
+    # or keep it running:       python refresh_events.py --interval 900
+
+
+def refresh_stale_artists(max_age, batch_size=50):
+    ''' refreshes events for all artists older than max_age, most followed artists first. returns how many artists and events were refreshed '''
+
+    artists_refreshed = 0
+    events_added = 0
+
+    while True:
+        artists = Artist.get_stale(max_age, limit=batch_size)
+        if not artists:
+            break
+
+            # same ingestion path the routes use, one transaction per batch
+        started = utc_now()
+        events_added += ticketmaster.add_events_to_db(artists)
+
+            # only artists stamped by this batch were refreshed, failed ones keep their old stamp
+        refreshed = [artist for artist in artists if artist.events_refreshed_at and artist.events_refreshed_at >= started]
+        artists_refreshed += len(refreshed)
+
+            # stops if nothing in the batch could be refreshed, the rest are tried on the next pass
+        if len(refreshed) < len(artists):
+            break
+
+    return artists_refreshed, events_added
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refreshes Ticketmaster events for all tracked artists.')
+    parser.add_argument('--max-age', type=float, default=6, help='hours before an artists events are refreshed again')
+    parser.add_argument('--interval', type=float, default=900, help='seconds to wait between passes')
+    parser.add_argument('--batch-size', type=int, default=50, help='artists refreshed per transaction')
+    parser.add_argument('--workers', type=int, default=None, help='artists requested at the same time')
+    parser.add_argument('--once', action='store_true', help='run one pass and exit')
+    args = parser.parse_args()
+
+    if args.workers:
+        ticketmaster.max_workers = args.workers
+
+    max_age = timedelta(hours=args.max_age)
+
+    with app.app_context():
+        while True:
+            start = time.monotonic()
+            artists_refreshed, events_added = refresh_stale_artists(max_age, batch_size=args.batch_size)
+            db.session.remove()
+
+            print(f'refreshed {artists_refreshed} artists, added {events_added} events in {time.monotonic() - start:.1f}s, quota left: {ticketmaster.remaining_quota}')
+
+            if args.once:
+                break
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,15 @@
 import base64
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 
+from http_client import get_http_client
+
 
 class SpotifyAPI:
     ''' class to handle all spotify functions '''
 
-    def __init__(self, client_id, client_secret, redirect_uri, base_url="https://api.spotify.com/v1", token_url='https://accounts.spotify.com/api/token', auth_url='https://accounts.spotify.com/authorize', scope='user-read-private user-read-email user-top-read streaming'):
+    def __init__(self, client_id, client_secret, redirect_uri, base_url="https://api.spotify.com/v1", token_url='https://accounts.spotify.com/api/token', auth_url='https://accounts.spotify.com/authorize', scope='user-read-private user-read-email user-top-read streaming', http=None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
@@ -15,6 +17,14 @@ class SpotifyAPI:
         self.token_url = token_url
         self.auth_url = auth_url
         self.scope = scope
+        self._http = http
+
+
+    @property
+    def http(self):
+        ''' returns the http client passed in, or the shared pooled client for this worker '''
+
+        return self._http or get_http_client()
 
 
 # TOKENS/ GENERIC SPOTIFY API
@@ -42,7 +52,7 @@ class SpotifyAPI:
 
         headers = self.auth_token_header()
 
-        res = requests.post(self.token_url, data=payload, headers=headers)
+        res = self.http.post(self.token_url, data=payload, headers=headers)
 
         return res.json()
 
@@ -57,28 +67,11 @@ class SpotifyAPI:
 
         headers = self.auth_token_header()
 
-        res = requests.post(self.token_url, data=payload, headers=headers)
+        res = self.http.post(self.token_url, data=payload, headers=headers)
 
         return res.json()    
 
 
-    def check_refesh_get_token(self, token_info=None):
-        ''' takes in token info and checks if token is expired. if token is expired, returns a new one'''
-
-        info = token_info
-
-        if info:
-                # checks if token expire time is less than current time (both in seconds)
-            if info['expires_at'] < int(time.time()):
-                    # refreshes token if needed
-                info = self.refresh_token(info['refresh_token'])
-                if info:
-                        # updates expiration time
-                    info['expires_at'] = int(time.time() + info['expires_in'])
-                return None
-        return info['access_token']
-    
-    
     def callback(self, code):
         ''' takes in a code to use to get token info, returns token info'''
 
@@ -129,15 +122,25 @@ class SpotifyAPI:
         ''' returns information on currently logged in user'''
 
             # requests user information
-        res = requests.get(f'{self.base_url}/me', headers=headers)
+        res = self.http.get(f'{self.base_url}/me', headers=headers)
         return res.json()
 
 
+    def get_cur_u_top(self, headers):
+        ''' requests the users top artists and top tracks at the same time, returns (top_artists, top_tracks) '''
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            top_artists = executor.submit(self.get_cur_u_top_artists, headers)
+            top_tracks = executor.submit(self.get_cur_u_top_tracks, headers)
+
+            return top_artists.result(), top_tracks.result()
+
+
     def get_cur_u_top_artists(self, headers):
         ''' gets the users top artists '''
 
             # requests top 10 artists data
-        top_artists = requests.get(
+        top_artists = self.http.get(
             f'{self.base_url}/me/top/artists',
             params={
                 'limit': 10,
@@ -177,7 +180,7 @@ class SpotifyAPI:
         ''' gets the users top tracks'''
 
             # requests top 3 tracks data
-        top_tracks = requests.get(
+        top_tracks = self.http.get(
             f'{self.base_url}/me/top/tracks',
             params={
                 'limit': 3,
@@ -0,0 +1,168 @@
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from models import db, SpotifyToken
+from cache import TTLCache
+
+
+class SpotifyTokenManager:
+    ''' keeps each users spotify access token and refreshes it shortly before it expires. refreshes are single flight: one per user at a time in a worker, and the token row is locked so other workers wait for it instead of refreshing again '''
+
+    def __init__(self, spotify, refresh_margin=300, min_validity=30, executor=None, app=None, max_tokens=1024):
+        self.spotify = spotify
+            # tokens with less than refresh_margin seconds left are refreshed in the background,
+            # with less than min_validity seconds left the request waits for the refresh
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        self.executor = executor
+        self.app = app
+
+            # tokens are kept until they expire for up to max_tokens users, the rest are read from the data base
+        self.tokens = TTLCache(maxsize=max_tokens)
+            # one lock per user being refreshed, removed once the refresh is done so the dict only holds refreshes in progress
+        self.user_locks = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.refreshes = 0
+
+
+    def user_lock(self, user_id):
+        ''' returns the lock for one user, made the first time it is needed '''
+
+        with self.lock:
+            return self.user_locks.setdefault(user_id, threading.Lock())
+
+
+    def seconds_left(self, info):
+        ''' returns how many seconds a token has left '''
+
+        return info['expires_at'] - time.time()
+
+
+    def remember(self, user_id, info):
+        ''' keeps a users token info in this worker until the token expires '''
+
+        self.tokens.set(user_id, info, ttl=self.seconds_left(info))
+
+
+    def save(self, user_id, token_info):
+        ''' saves new token info for a user, like the token from the spotify callback, and commits it '''
+
+        if 'expires_at' not in token_info:
+            token_info['expires_at'] = int(time.time() + token_info['expires_in'])
+
+        info = SpotifyToken.save(user_id, token_info).to_info()
+        db.session.commit()
+
+        self.remember(user_id, info)
+        return info
+
+
+    def forget(self, user_id):
+        ''' removes a users token from this worker and the data base '''
+
+        self.tokens.invalidate(user_id)
+
+        SpotifyToken.query.filter_by(user_id=user_id).delete()
+        db.session.commit()
+
+
+    def get_access_token(self, user_id):
+        ''' returns a valid access token for a user, None if they have not connected spotify or the refresh failed '''
+
+        info = self.tokens.get(user_id)
+
+        if not info:
+            token = db.session.get(SpotifyToken, user_id)
+            if not token:
+                return None
+
+            info = token.to_info()
+            self.remember(user_id, info)
+
+        seconds_left = self.seconds_left(info)
+
+        if seconds_left > self.refresh_margin:
+            return info['access_token']
+
+            # still valid for a while, answers now and refreshes in the background
+        if seconds_left > self.min_validity and self.executor and self.app:
+            self.refresh_in_background(user_id)
+            return info['access_token']
+
+        info = self.refresh(user_id)
+        return info['access_token'] if info else None
+
+
+    def refresh(self, user_id):
+        ''' refreshes a users token unless another request already did, saves the new token and returns its info. None if the refresh failed '''
+
+        with self.user_lock(user_id):
+            try:
+                return self.refresh_locked(user_id)
+            finally:
+                with self.lock:
+                    self.user_locks.pop(user_id, None)
+
+
+    def refresh_locked(self, user_id):
+        ''' refreshes a users token while holding their lock. uses its own session so nothing the request has not commited is commited or rolled back here '''
+
+            # another thread in this worker may have refreshed while this one waited
+        info = self.tokens.get(user_id)
+        if info and self.seconds_left(info) > self.refresh_margin:
+            return info
+
+        with Session(db.engine) as session:
+                # locks the row so other workers wait for this refresh, sqlite has no row locks and skips this
+            token = session.query(SpotifyToken).filter_by(user_id=user_id).with_for_update().first()
+            if not token:
+                return None
+
+                # another worker may have refreshed while this one waited
+            if self.seconds_left(token.to_info()) > self.refresh_margin:
+                info = token.to_info()
+            else:
+                try:
+                    refreshed = self.spotify.refresh_token(token.refresh_token)
+                except Exception as e:
+                    print(f'error refreshing spotify token: {e}')
+                    refreshed = None
+
+                if not refreshed or 'access_token' not in refreshed:
+                    return None
+
+                refreshed['expires_at'] = int(time.time() + refreshed['expires_in'])
+                info = SpotifyToken.save(user_id, refreshed, session=session).to_info()
+                session.commit()
+                self.refreshes += 1
+
+        self.remember(user_id, info)
+        return info
+
+
+    def refresh_in_background(self, user_id):
+        ''' queues a refresh for a user unless one is already queued '''
+
+        with self.lock:
+            if user_id in self.refreshing:
+                return
+            self.refreshing.add(user_id)
+
+        self.executor.submit(self.background_refresh, user_id)
+
+
+    def background_refresh(self, user_id):
+        ''' refreshes a token outside of a request, uses its own app context and session '''
+
+        try:
+            with self.app.app_context():
+                self.refresh(user_id)
+                db.session.remove()
+        except Exception as e:
+            print(f'error refreshing spotify token: {e}')
+        finally:
+            with self.lock:
+                self.refreshing.discard(user_id)
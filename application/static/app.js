@@ -1,15 +1,40 @@
 document.addEventListener("DOMContentLoaded", async () => {
+  // cached pages leave the csrf token out, gets one for this session
+  const csrfInputs = document.querySelectorAll("[data-csrf-token]");
+  if (csrfInputs.length) {
+    try {
+      const res = await axios.get("/csrf-token");
+      csrfInputs.forEach((input) => (input.value = res.data.csrf_token));
+    } catch (e) {
+      console.error("could not get csrf token", e);
+    }
+  }
+
   if (document.querySelector("#featured-events")) {
     const topArtistList = document.getElementById("top-artist-list");
     const featuredEventsContainer = document.getElementById("featured-events");
+    const eventsAsOf = document.getElementById("top-events-as-of");
 
     try {
       const res = await axios.get("/top-artists-events");
-      const data = await res.data;
-      const wishlist = await axios.get("/get-wishlist");
+      // each event says if it is on the wishlist, so the whole wishlist is not requested
+      const data = await res.data.events;
 
       topArtistList.innerHTML = "";
 
+      // shows how fresh the events are, they are refreshed in the background when old
+      if (res.data.as_of) {
+        eventsAsOf.textContent = `Updated ${new Date(
+          res.data.as_of
+        ).toLocaleString()}`;
+      } else if (res.data.refreshing) {
+        eventsAsOf.textContent = "Finding events, check back soon...";
+      }
+
+      if (!data.length && res.data.refreshing) {
+        topArtistList.innerHTML = "<h3> Finding Your Artist's Events... </h3>";
+      }
+
       data.forEach((eventGroup, index) => {
         const featuredEvents = document.createElement("div");
         featuredEvents.className = "row row-cols-xs-1 row-cols-sm-2";
@@ -43,7 +68,7 @@ document.addEventListener("DOMContentLoaded", async () => {
 
             const fImg = document.createElement("img");
             fImg.className = "img-fluid rounded-start grid-card-img";
-            fImg.src = event.image;
+            fImg.src = event.thumb || event.image;
 
             const fBodyCol = document.createElement("div");
             fBodyCol.className = "col-md-8";
@@ -73,7 +98,7 @@ document.addEventListener("DOMContentLoaded", async () => {
             fTicketBtn.href = event.url;
 
             const fWishBtn = document.createElement("a");
-            if (wishlist.data.includes(event.event_id)) {
+            if (event.wishlisted) {
               fWishBtn.className = "btn btn-danger ms-3 wishlistBtn";
               fWishBtn.textContent = "Remove from Wishlist";
               fWishBtn.dataset.eventid = event.event_id;
@@ -101,7 +126,7 @@ document.addEventListener("DOMContentLoaded", async () => {
           card.className = "card";
 
           const cardImg = document.createElement("img");
-          cardImg.src = event.image;
+          cardImg.src = event.thumb || event.image;
           cardImg.className = "card-img-top";
           cardImg.style = "max-height: 230px";
 
@@ -130,7 +155,7 @@ document.addEventListener("DOMContentLoaded", async () => {
           cardTicketBtn.href = event.url;
 
           const cardWishBtn = document.createElement("a");
-          if (wishlist.data.includes(event.event_id)) {
+          if (event.wishlisted) {
             cardWishBtn.className = "btn btn-danger ms-3 wishlistBtn";
             cardWishBtn.textContent = "Remove from Wishlist";
             cardWishBtn.dataset.eventid = event.event_id;
@@ -0,0 +1,351 @@
+import argparse
+import io
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+    # pillow is optional, /images only serves images when it is installed
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+    # stand in for the ticketmaster discovery and spotify apis so the app can be load tested without using real quota.
+    # serves files from a fixtures folder when they exist, otherwise makes up data that looks like the real responses.
+    # run it on its own:   python stub_server.py --port 5050 --latency 0.05 --rate-limit-rate 0.01
+    # or inside a test:    with StubServer() as stub: TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url)
+
+
+class StubData:
+    ''' makes up artists and events that look like ticketmaster and spotify data. the same seed always makes the same data '''
+
+    CITIES = [
+        ('Los Angeles', 'California', 34.0522, -118.2437),
+        ('New York', 'New York', 40.7128, -74.0060),
+        ('Chicago', 'Illinois', 41.8781, -87.6298),
+        ('Austin', 'Texas', 30.2672, -97.7431),
+        ('Seattle', 'Washington', 47.6062, -122.3321),
+        ('Denver', 'Colorado', 39.7392, -104.9903),
+        ('Nashville', 'Tennessee', 36.1627, -86.7816),
+        ('Miami', 'Florida', 25.7617, -80.1918)
+    ]
+
+    def __init__(self, num_artists=50, events_per_artist=6, seed=0):
+        rand = random.Random(seed)
+        start = datetime.now(timezone.utc).replace(hour=19, minute=0, second=0, microsecond=0)
+
+        self.artists = []
+        self.events = []
+
+        for i in range(num_artists):
+            artist = {
+                'id': f'stubartist{i:04}',
+                'name': f'Stub Artist {i}',
+                'attraction_id': f'K8vZ917{i:04}',
+                'spotify_url': f'https://open.spotify.com/artist/stubartist{i:04}',
+                'images': self.make_images(f'artist{i}')
+            }
+            self.artists.append(artist)
+
+            for j in range(events_per_artist):
+                city, state, lat, long = rand.choice(self.CITIES)
+                date = start + timedelta(days=rand.randint(1, 365))
+                self.events.append({
+                    'id': f'stubevent{i:04}{j:02}',
+                    'name': f'{artist["name"]} Live {j + 1}',
+                    'type': 'event',
+                    'url': f'https://www.ticketmaster.com/event/stubevent{i:04}{j:02}',
+                    'images': self.make_images(f'event{i}-{j}'),
+                    'dates': {'start': {'localDate': date.strftime('%Y-%m-%d'), 'dateTime': date.strftime('%Y-%m-%dT%H:%M:%SZ')}},
+                    '_embedded': {
+                        'venues': [{
+                            'id': f'stubvenue{self.CITIES.index((city, state, lat, long)):02}{j % 3}',
+                            'name': f'{city} Arena {j % 3}',
+                            'city': {'name': city},
+                            'state': {'name': state},
+                            'location': {'latitude': str(round(lat + rand.uniform(-0.1, 0.1), 6)), 'longitude': str(round(long + rand.uniform(-0.1, 0.1), 6))}
+                        }],
+                        'attractions': [{'id': artist['attraction_id'], 'name': artist['name']}]
+                    }
+                })
+
+        rand.shuffle(self.events)
+        self.events_by_id = {event['id']: event for event in self.events}
+
+
+    @staticmethod
+    def make_images(key):
+        ''' makes a list of images in a few sizes like the real apis return '''
+
+        return [{'url': f'https://images.example.com/{key}/{width}.jpg', 'width': width, 'height': width * 9 // 16} for width in (100, 305, 640, 1024, 2048)]
+
+
+    def attraction(self, artist):
+        ''' returns an artist as a ticketmaster attraction '''
+
+        return {
+            'id': artist['attraction_id'],
+            'name': artist['name'],
+            'externalLinks': {'spotify': [{'url': artist['spotify_url']}]}
+        }
+
+
+    def spotify_artist(self, artist):
+        ''' returns an artist as a spotify artist '''
+
+        return {
+            'id': artist['id'],
+            'name': artist['name'],
+            'external_urls': {'spotify': artist['spotify_url']},
+            'images': artist['images']
+        }
+
+
+    def spotify_track(self, artist, i):
+        ''' returns a made up spotify track for an artist '''
+
+        return {
+            'id': f'{artist["id"]}track{i}',
+            'name': f'{artist["name"]} Song {i}',
+            'album': {'name': f'{artist["name"]} Album', 'artists': [{'name': artist['name']}], 'images': artist['images']}
+        }
+
+
+def create_stub_app(latency=0.0, error_rate=0.0, rate_limit_rate=0.0, fixtures_dir=None, daily_quota=5000, seed=0, num_artists=50, events_per_artist=6):
+    ''' creates the stub flask app. latency is seconds added to every request, error_rate and rate_limit_rate are the chance of a 500 or 429 response '''
+
+    app = Flask(__name__)
+    data = StubData(num_artists=num_artists, events_per_artist=events_per_artist, seed=seed)
+    rand = random.Random(seed)
+    lock = threading.Lock()
+    quota = {'available': daily_quota}
+    stats = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+
+    app.config['STUB_STATS'] = stats
+
+
+    def fixture(name):
+        ''' returns a recorded fixture if there is one in the fixtures folder '''
+
+        if not fixtures_dir:
+            return None
+
+        path = os.path.join(fixtures_dir, f'{name}.json')
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                return json.load(file)
+        return None
+
+
+    def page(items, size, number, key):
+        ''' returns one page of items the way the discovery api does '''
+
+        total_pages = (len(items) + size - 1) // size
+        body = {'page': {'size': size, 'totalElements': len(items), 'totalPages': total_pages, 'number': number}}
+        items = items[number * size:(number + 1) * size]
+
+            # the discovery api leaves out _embedded when there are no results
+        if items:
+            body['_embedded'] = {key: items}
+        return body
+
+
+    def rate_limit_headers(response):
+        ''' adds the discovery api rate limit headers '''
+
+        reset = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        response.headers['Rate-Limit'] = str(daily_quota)
+        response.headers['Rate-Limit-Available'] = str(max(quota['available'], 0))
+        response.headers['Rate-Limit-Over'] = str(max(-quota['available'], 0))
+        response.headers['Rate-Limit-Reset'] = str(int(reset.timestamp() * 1000))
+        return response
+
+
+    @app.before_request
+    def inject_faults():
+        ''' adds latency and random errors to every request '''
+
+        with lock:
+            stats['requests'] += 1
+            roll = rand.random()
+            if request.path.startswith('/discovery'):
+                quota['available'] -= 1
+
+        if latency:
+            time.sleep(latency)
+
+        if roll < rate_limit_rate:
+            with lock:
+                stats['rate_limited'] += 1
+            response = jsonify({'fault': {'faultstring': 'Spike arrest violation', 'detail': {'errorcode': 'policies.ratelimit.SpikeArrestViolation'}}})
+            response.status_code = 429
+            response.headers['Retry-After'] = '1'
+            return rate_limit_headers(response)
+
+        if roll < rate_limit_rate + error_rate:
+            with lock:
+                stats['errors'] += 1
+            return jsonify({'error': 'stub error'}), 500
+
+
+    @app.route('/discovery/v2/attractions.json')
+    def attractions():
+        keyword = request.args.get('keyword', '').lower()
+        body = fixture('attractions') or page([data.attraction(artist) for artist in data.artists if keyword in artist['name'].lower()], 20, 0, 'attractions')
+        return rate_limit_headers(jsonify(body))
+
+
+    @app.route('/discovery/v2/events.json')
+    def events():
+        body = fixture('events')
+
+        if not body:
+            attraction_id = request.args.get('attractionId')
+            events = data.events
+
+            if attraction_id:
+                events = [event for event in events if event['_embedded']['attractions'][0]['id'] == attraction_id]
+
+            size = request.args.get('size', 20, type=int)
+            number = request.args.get('page', 0, type=int)
+            body = page(events, size, number, 'events')
+        return rate_limit_headers(jsonify(body))
+
+
+    @app.route('/discovery/v2/events')
+    def event():
+        body = fixture('event')
+
+        if not body:
+            event = data.events_by_id.get(request.args.get('id'))
+            body = page([event] if event else [], 20, 0, 'events')
+        return rate_limit_headers(jsonify(body))
+
+
+    @app.route('/api/token', methods=['POST'])
+    def token():
+        return jsonify(fixture('token') or {
+            'access_token': f'stub-access-{rand.getrandbits(32):08x}',
+            'token_type': 'Bearer',
+            'scope': 'user-read-private user-read-email user-top-read streaming',
+            'expires_in': 3600,
+            'refresh_token': request.form.get('refresh_token', 'stub-refresh-token')
+        })
+
+
+    @app.route('/v1/me')
+    def me():
+        return jsonify(fixture('me') or {'id': 'stubuser', 'display_name': 'Stub User', 'email': 'stub@example.com', 'country': 'US'})
+
+
+    @app.route('/v1/me/top/artists')
+    def top_artists():
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify(fixture('top_artists') or {'items': [data.spotify_artist(artist) for artist in data.artists[:limit]]})
+
+
+    @app.route('/v1/me/top/tracks')
+    def top_tracks():
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify(fixture('top_tracks') or {'items': [data.spotify_track(artist, 1) for artist in data.artists[:limit]]})
+
+
+    @app.route('/images/<key>/<int:width>.jpg')
+    def image(key, width):
+        if not Image:
+            return jsonify({'error': 'pillow is not installed'}), 404
+
+        output = io.BytesIO()
+        color = tuple(random.Random(key).randrange(256) for _ in range(3))
+        Image.new('RGB', (width, width * 9 // 16), color).save(output, 'JPEG', quality=90)
+        return output.getvalue(), 200, {'Content-Type': 'image/jpeg'}
+
+
+    @app.route('/stats')
+    def get_stats():
+        with lock:
+            return jsonify(stats)
+
+    return app
+
+
+class StubServer:
+    ''' runs the stub app on a background thread, use it as a context manager in tests and benchmarks '''
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.app = create_stub_app(**options)
+        self.server = make_server(host, port, self.app, threaded=True)
+        self.url = f'http://{host}:{self.server.server_port}'
+        self.ticketmaster_url = f'{self.url}/discovery/v2'
+        self.spotify_url = f'{self.url}/v1'
+        self.token_url = f'{self.url}/api/token'
+        self.images_url = f'{self.url}/images'
+        self.thread = None
+
+
+    @property
+    def stats(self):
+        ''' returns how many requests were served, errored and rate limited '''
+
+        return dict(self.app.config['STUB_STATS'])
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a local stand in for the Ticketmaster and Spotify APIs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of a 500 response')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='chance of a 429 response')
+    parser.add_argument('--daily-quota', type=int, default=5000)
+    parser.add_argument('--fixtures', default=None, help='folder of recorded responses: attractions.json, events.json, event.json, token.json, me.json, top_artists.json, top_tracks.json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--artists', type=int, default=50)
+    parser.add_argument('--events-per-artist', type=int, default=6)
+    args = parser.parse_args()
+
+    server = StubServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        fixtures_dir=args.fixtures,
+        daily_quota=args.daily_quota,
+        seed=args.seed,
+        num_artists=args.artists,
+        events_per_artist=args.events_per_artist
+    )
+
+    print(f'Ticketmaster base_url: {server.ticketmaster_url}')
+    print(f'Spotify base_url: {server.spotify_url}  token_url: {server.token_url}')
+    server.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,686 @@
+import os
+from unittest import TestCase, skipUnless
+import time
+import tempfile
+import threading
+from datetime import timedelta
+from models import db, User, Artist, AttractionLookup, Event, SpotifyToken, utc_now
+
+os.environ['DATABASE_URL'] = "postgresql:///artists_test"
+
+from app import app
+from ticketmaster import TicketmasterAPI, TicketmasterError
+from spotify import SpotifyAPI
+from http_client import HTTPClient
+from rate_limit import RateLimiter, RateLimitError
+from cache import TTLCache
+from stub_server import StubServer
+from spotify_tokens import SpotifyTokenManager
+from event_parser import parse_page, DEFAULT_IMAGE
+from bench_event_parser import make_page, legacy_parse_page
+from models import CreateEvent
+from images import ImageCache, Image
+import geo
+import pgeocode
+import refresh_events
+
+with app.app_context():
+    db.create_all()
+
+
+class TicketmasterAPITestCase(TestCase):
+    ''' Tests the ticketmaster api class against the stub server '''
+
+    @classmethod
+    def setUpClass(cls):
+        ''' Starts the stub server '''
+        cls.stub = StubServer().start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        ''' Stops the stub server '''
+        cls.stub.stop()
+
+
+    def setUp(self):
+        ''' Clears all data '''
+        with app.app_context():
+            Artist.query.delete()
+            AttractionLookup.query.delete()
+
+            db.session.commit()
+
+        self.http = HTTPClient()
+        self.ticketmaster = TicketmasterAPI(api_key='stub', base_url=self.stub.ticketmaster_url, http=self.http, generic_events_cache=TTLCache())
+        self.spotify = SpotifyAPI(client_id='stub', client_secret='stub', redirect_uri='http://localhost/callback', base_url=self.stub.spotify_url, token_url=self.stub.token_url, http=self.http)
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        with app.app_context():
+            Artist.query.delete()
+            AttractionLookup.query.delete()
+
+            db.session.commit()
+
+        self.http.close()
+
+
+    def test_get_generic_events(self):
+        ''' tests generic events have no repeated artists and are cached '''
+
+        events = self.ticketmaster.get_generic_events()
+
+        self.assertEqual(len(events), 20)
+        self.assertEqual(len({event['artist'] for event in events}), 20)
+
+        requests_sent = self.stub.stats['requests']
+        self.ticketmaster.get_generic_events()
+
+        self.assertEqual(self.stub.stats['requests'], requests_sent)
+        self.assertEqual(self.ticketmaster.generic_events_cache.stats()['hits'], 1)
+
+            # every stub event has a venue with coordinates
+        for event in events:
+            self.assertEqual(event['venue_id'], event['venue']['id'])
+            self.assertIsNotNone(event['venue']['geohash'])
+
+
+    def test_set_up_artists(self):
+        ''' tests attraction ids are found in order and saved so they are not requested again '''
+
+        with app.app_context():
+            top_artists = self.spotify.get_cur_u_top_artists({'Authorization': 'Bearer stub'})
+            top_artists.append({'name': 'Not On Ticketmaster', 'spotify_id': 'missing', 'spotify_url': 'https://open.spotify.com/artist/missing', 'image_url': ''})
+
+            artists = self.ticketmaster.set_up_artists(top_artists)
+
+            self.assertEqual([artist['name'] for artist in artists], [artist['name'] for artist in top_artists[:10]])
+            self.assertEqual(artists[0]['attraction_id'], 'K8vZ9170000')
+
+            requests_sent = self.stub.stats['requests']
+            self.ticketmaster.set_up_artists(top_artists)
+
+            self.assertEqual(self.stub.stats['requests'], requests_sent)
+
+
+    def test_failed_lookups_not_saved(self):
+        ''' tests attraction lookups that failed are not saved as misses so they are requested again '''
+
+        with StubServer(error_rate=1.0) as stub, app.app_context():
+            http = HTTPClient(retries=0)
+            ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=http, server_error_retries=0)
+            top_artists = self.spotify.get_cur_u_top_artists({'Authorization': 'Bearer stub'})[:3]
+
+            self.assertEqual(ticketmaster.set_up_artists(top_artists), [])
+            self.assertEqual(AttractionLookup.query.count(), 0)
+
+            http.close()
+
+        with app.app_context():
+            artists = self.ticketmaster.set_up_artists(top_artists)
+
+            self.assertEqual(len(artists), 3)
+
+
+    def test_paginate_events(self):
+        ''' tests pages stop at max_pages and the last page, and no pages are requested after the caller stops '''
+
+        requests_sent = self.stub.stats['requests']
+        events = list(self.ticketmaster.paginate_events({'apikey': 'stub'}, page_size=5, max_pages=3))
+
+        self.assertEqual(len(events), 15)
+        self.assertEqual(self.stub.stats['requests'] - requests_sent, 3)
+
+            # stub artists have 6 events, the second page of 4 is the last
+        requests_sent = self.stub.stats['requests']
+        events = list(self.ticketmaster.paginate_events({'attractionId': 'K8vZ9170000', 'apikey': 'stub'}, page_size=4, max_pages=10))
+
+        self.assertEqual(len(events), 6)
+        self.assertEqual(self.stub.stats['requests'] - requests_sent, 2)
+
+        requests_sent = self.stub.stats['requests']
+        pages = self.ticketmaster.paginate_events({'apikey': 'stub'}, page_size=5, max_pages=10)
+        events = [next(pages) for _ in range(7)]
+        pages.close()
+        time.sleep(0.2)
+
+            # the first two pages and at most the prefetch of the third
+        self.assertEqual(len(events), 7)
+        self.assertLessEqual(self.stub.stats['requests'] - requests_sent, 3)
+
+
+    def test_get_cur_u_top(self):
+        ''' tests top artists and top tracks are requested together and parsed '''
+
+        top_artists, top_tracks = self.spotify.get_cur_u_top({'Authorization': 'Bearer stub'})
+
+        self.assertEqual(len(top_artists), 10)
+        self.assertEqual(top_artists[0]['spotify_id'], 'stubartist0000')
+        self.assertEqual(len(top_tracks), 3)
+        self.assertEqual(top_tracks[0]['artist'], 'Stub Artist 0')
+
+
+    def test_connections_reused(self):
+        ''' tests the pooled client reuses its connection '''
+
+        for _ in range(3):
+            self.ticketmaster.get_event('stubevent000000')
+
+        self.assertGreaterEqual(self.http.stats()['reused'], 2)
+
+
+    def test_rate_limited_request(self):
+        ''' tests a request still rate limited after retrying raises RateLimitError '''
+
+        with StubServer(rate_limit_rate=1.0) as stub:
+            ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=self.http, rate_limiter=RateLimiter(max_retries=1, backoff_base=0.01))
+
+            with self.assertRaises(RateLimitError):
+                ticketmaster.request('events.json', params={'apikey': 'stub'})
+
+            self.assertEqual(stub.stats['rate_limited'], 2)
+            self.assertIsNotNone(ticketmaster.remaining_quota)
+
+
+    def test_long_retry_after(self):
+        ''' tests a Retry-After longer than max_retry_after fails right away instead of blocking the request '''
+
+        rate_limiter = RateLimiter(backoff_base=0.01, max_retry_after=5)
+
+        self.assertGreaterEqual(rate_limiter.backoff(0, '2'), 2)
+
+        start = time.monotonic()
+        with self.assertRaises(RateLimitError):
+            rate_limiter.backoff(0, '3600')
+
+        self.assertLess(time.monotonic() - start, 1)
+
+
+    def test_server_errors_paced(self):
+        ''' tests 5xx responses are retried by request, not the http client, so every attempt takes a token from the rate limiter '''
+
+        with StubServer(error_rate=1.0) as stub:
+            http = HTTPClient(retries=3)
+            ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=http, server_error_retries=2, server_error_backoff=0)
+
+            acquired = []
+            acquire = ticketmaster.rate_limiter.acquire
+            ticketmaster.rate_limiter.acquire = lambda: acquired.append(1) or acquire()
+
+            with self.assertRaises(TicketmasterError):
+                ticketmaster.request('events.json', params={'apikey': 'stub'})
+
+            self.assertEqual(stub.stats['requests'], 3)
+            self.assertEqual(len(acquired), 3)
+
+            http.close()
+
+
+    def test_failed_requests(self):
+        ''' tests error responses raise TicketmasterError, and artists whose events could not be requested are not marked refreshed '''
+
+        with StubServer(error_rate=1.0) as stub:
+            http = HTTPClient(retries=0)
+            ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=http, generic_events_cache=TTLCache(), server_error_retries=0)
+
+            with self.assertRaises(TicketmasterError):
+                ticketmaster.request('events.json', params={'apikey': 'stub'})
+
+            self.assertEqual(ticketmaster.get_generic_events(), [])
+            self.assertIsNone(ticketmaster.get_event('stubevent000000'))
+
+            with app.app_context():
+                artist = Artist(name='Stub Artist 0', spotify_id='stubartist0000', spotify_url='https://open.spotify.com/artist/stubartist0000', image='', attraction_id='K8vZ9170000')
+                db.session.add(artist)
+                db.session.commit()
+
+                self.assertEqual(ticketmaster.add_events_to_db([artist]), 0)
+                self.assertIsNone(db.session.get(Artist, artist.id).events_refreshed_at)
+
+            http.close()
+
+        ticketmaster = TicketmasterAPI(api_key='stub', base_url='http://127.0.0.1:9/discovery/v2', http=HTTPClient(retries=0))
+
+        with self.assertRaises(TicketmasterError):
+            ticketmaster.request('events.json', params={'apikey': 'stub'})
+
+
+class RefreshEventsTestCase(TestCase):
+    ''' Tests the background refresh job against the stub server '''
+
+    def setUp(self):
+        ''' Adds stub artists, two of them refreshed an hour ago '''
+        with app.app_context():
+            Event.query.delete()
+            Artist.query.delete()
+
+            artists = [Artist(name=f'Stub Artist {i}', spotify_id=f'stubartist{i:04}', spotify_url=f'https://open.spotify.com/artist/stubartist{i:04}', image='', attraction_id=f'K8vZ917{i:04}') for i in range(5)]
+            for artist in artists[3:]:
+                artist.events_refreshed_at = utc_now() - timedelta(hours=1)
+            db.session.add_all(artists)
+            db.session.commit()
+
+            self.fresh_ids = {artist.id for artist in artists[3:]}
+
+        self.http = HTTPClient(retries=0)
+        self.saved_ticketmaster = refresh_events.ticketmaster
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        refresh_events.ticketmaster = self.saved_ticketmaster
+        self.http.close()
+
+        with app.app_context():
+            Event.query.delete()
+            Artist.query.delete()
+
+            db.session.commit()
+
+
+    def test_refresh_stale_artists(self):
+        ''' tests every stale artist is refreshed in batches and fresh artists are left alone '''
+
+        with StubServer() as stub:
+            refresh_events.ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=self.http)
+
+            with app.app_context():
+                artists_refreshed, events_added = refresh_events.refresh_stale_artists(timedelta(hours=6), batch_size=2)
+
+                self.assertEqual(artists_refreshed, 3)
+                self.assertEqual(events_added, 6)
+                self.assertEqual(Artist.get_stale(timedelta(hours=6)), [])
+                self.assertEqual({event.artist_id for event in Event.query.all()}, {artist.id for artist in Artist.query.all()} - self.fresh_ids)
+
+                self.assertEqual(refresh_events.refresh_stale_artists(timedelta(hours=6), batch_size=2), (0, 0))
+
+
+    def test_stops_after_failed_batch(self):
+        ''' tests the job stops when nothing in a batch could be refreshed instead of requesting the same artists again '''
+
+        with StubServer(error_rate=1.0) as stub:
+            refresh_events.ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=self.http, server_error_retries=0)
+
+            with app.app_context():
+                self.assertEqual(refresh_events.refresh_stale_artists(timedelta(hours=6), batch_size=2), (0, 0))
+                self.assertEqual(stub.stats['requests'], 2)
+                self.assertEqual(len(Artist.get_stale(timedelta(hours=6))), 3)
+
+
+    def test_stops_after_failed_batch_of_old_artists(self):
+        ''' tests the job also stops when the failed artists were refreshed before and still have their old stamp '''
+
+        with app.app_context():
+            for artist in Artist.query.all():
+                artist.events_refreshed_at = utc_now() - timedelta(hours=7)
+            db.session.commit()
+
+        with StubServer(error_rate=1.0) as stub:
+            refresh_events.ticketmaster = TicketmasterAPI(api_key='stub', base_url=stub.ticketmaster_url, http=self.http, server_error_retries=0)
+
+            with app.app_context():
+                self.assertEqual(refresh_events.refresh_stale_artists(timedelta(hours=6), batch_size=2), (0, 0))
+                self.assertEqual(stub.stats['requests'], 2)
+                self.assertEqual(len(Artist.get_stale(timedelta(hours=6))), 5)
+
+
+class SpotifyTokenManagerTestCase(TestCase):
+    ''' Tests the spotify token manager against the stub server '''
+
+    @classmethod
+    def setUpClass(cls):
+        ''' Starts the stub server '''
+        cls.stub = StubServer().start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        ''' Stops the stub server '''
+        cls.stub.stop()
+
+
+    def setUp(self):
+        ''' Adds a user with an expired token '''
+        with app.app_context():
+            SpotifyToken.query.delete()
+            User.query.delete()
+
+            user = User(name='Test User', username='TestUsername', email='TestEmail@test.com', password='TestPassword', country='United States of America', country_code='US', zipcode='90001')
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+        self.http = HTTPClient()
+        self.spotify = SpotifyAPI(client_id='stub', client_secret='stub', redirect_uri='http://localhost/callback', base_url=self.stub.spotify_url, token_url=self.stub.token_url, http=self.http)
+        self.tokens = SpotifyTokenManager(self.spotify)
+
+        with app.app_context():
+            self.tokens.save(self.user_id, {'access_token': 'expired', 'refresh_token': 'refresh', 'expires_at': int(time.time()) - 10})
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        with app.app_context():
+            SpotifyToken.query.delete()
+            User.query.delete()
+
+            db.session.commit()
+
+        self.http.close()
+
+
+    def test_refresh_single_flight(self):
+        ''' tests concurrent requests for an expired token refresh it once and the new token is saved '''
+
+        requests_sent = self.stub.stats['requests']
+        access_tokens = []
+
+        def get_token():
+            with app.app_context():
+                access_tokens.append(self.tokens.get_access_token(self.user_id))
+                db.session.remove()
+
+        threads = [threading.Thread(target=get_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.stub.stats['requests'] - requests_sent, 1)
+        self.assertEqual(self.tokens.refreshes, 1)
+        self.assertEqual(len(set(access_tokens)), 1)
+        self.assertNotEqual(access_tokens[0], 'expired')
+        self.assertEqual(self.tokens.user_locks, {})
+
+        with app.app_context():
+            token = db.session.get(SpotifyToken, self.user_id)
+
+            self.assertEqual(token.access_token, access_tokens[0])
+            self.assertEqual(token.refresh_token, 'refresh')
+
+
+    def test_tokens_bounded(self):
+        ''' tests tokens are only kept until they expire and for up to max_tokens users '''
+
+        tokens = SpotifyTokenManager(self.spotify, max_tokens=2)
+
+        with app.app_context():
+            users = [User(name='Test User', username=f'TestUsername{i}', email=f'TestEmail{i}@test.com', password='TestPassword', country='United States of America', country_code='US', zipcode='90001') for i in range(3)]
+            db.session.add_all(users)
+            db.session.commit()
+
+            for user in users:
+                tokens.save(user.id, {'access_token': f'fresh{user.id}', 'expires_in': 3600})
+            tokens.save(self.user_id, {'access_token': 'expired', 'refresh_token': 'refresh', 'expires_at': int(time.time()) - 10})
+
+            self.assertLessEqual(len(tokens.tokens.entries), 2)
+            self.assertIsNone(tokens.tokens.get(self.user_id))
+
+                # tokens no longer kept are read from the data base
+            self.assertEqual(tokens.get_access_token(users[0].id), f'fresh{users[0].id}')
+
+
+    def test_refresh_leaves_request_session(self):
+        ''' tests a refresh neither commits nor rolls back changes the request has not commited yet '''
+
+        with app.app_context():
+            user = User(name='Pending User', username='PendingUsername', email='Pending@test.com', password='TestPassword', country='United States of America', country_code='US', zipcode='90001')
+            db.session.add(user)
+
+            with db.session.no_autoflush:
+                access_token = self.tokens.get_access_token(self.user_id)
+
+            self.assertNotEqual(access_token, 'expired')
+            self.assertEqual(self.tokens.refreshes, 1)
+            self.assertIn(user, db.session.new)
+
+            db.session.rollback()
+            self.assertIsNone(User.query.filter_by(username='PendingUsername').first())
+            self.assertEqual(db.session.get(SpotifyToken, self.user_id).access_token, access_token)
+
+
+    def test_fresh_token_not_refreshed(self):
+        ''' tests a token with time left is returned without a refresh, also after a restart '''
+
+        with app.app_context():
+            self.tokens.save(self.user_id, {'access_token': 'fresh', 'expires_in': 3600})
+
+            self.assertEqual(SpotifyTokenManager(self.spotify).get_access_token(self.user_id), 'fresh')
+            self.assertEqual(self.tokens.refreshes, 0)
+
+
+class EventParserTestCase(TestCase):
+    ''' Tests the event parser gives the same events as the old parsing '''
+
+    def test_parse_page(self):
+        ''' tests both decoders match the old parsing on a full page '''
+
+        page = make_page(200)
+        expected = legacy_parse_page(page)
+
+        for use_msgspec in (False, True):
+            events = [event.to_dict() for event in parse_page(page, use_msgspec=use_msgspec)]
+
+            self.assertEqual(len(events), 200)
+            self.assertEqual([{key: event[key] for key in expected[0]} for event in events], expected)
+            self.assertEqual(events[0]['venue_id'], events[0]['venue']['id'])
+            self.assertIsNotNone(events[0]['venue']['geohash'])
+
+
+    def test_missing_fields(self):
+        ''' tests events missing most fields still parse, and pages with no events are empty '''
+
+        event = CreateEvent({'id': '00000', 'images': [], '_embedded': {'attractions': []}}).create_event()
+
+        self.assertEqual(event['artist'], 'could not get artist name')
+        self.assertEqual(event['image'], DEFAULT_IMAGE)
+        self.assertEqual(event['location'], 'TBA')
+        self.assertIsNone(event['date'])
+        self.assertIsNone(event['venue'])
+
+        self.assertEqual(parse_page(b'{"page": {"totalElements": 0}}'), [])
+        self.assertEqual(parse_page(b'{"page": {"totalElements": 0}}', use_msgspec=False), [])
+
+
+@skipUnless(Image, 'pillow is not installed')
+class ImageCacheTestCase(TestCase):
+    ''' Tests image variants are made from one download and old ones are removed '''
+
+    @classmethod
+    def setUpClass(cls):
+        ''' Starts the stub server '''
+        cls.stub = StubServer().start()
+
+
+    @classmethod
+    def tearDownClass(cls):
+        ''' Stops the stub server '''
+        cls.stub.stop()
+
+
+    def setUp(self):
+        ''' Makes an empty cache folder '''
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.http = HTTPClient()
+        self.images = ImageCache(self.cache_dir.name, http=self.http, allowed_hosts=['127.0.0.1'])
+
+
+    def tearDown(self):
+        ''' Removes the cache folder '''
+        self.cache_dir.cleanup()
+        self.http.close()
+
+
+    def test_variants_made_once(self):
+        ''' tests every width is made from one download and is never wider than asked for '''
+
+        url = f'{self.stub.images_url}/event0-0/2048.jpg'
+        requests_sent = self.stub.stats['requests']
+
+        path = self.images.get(url, 300)
+
+        with Image.open(path) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.width, 320)
+
+        for width in (100, 640, 2000):
+            self.assertIsNotNone(self.images.get(url, width))
+
+        self.assertEqual(self.stub.stats['requests'] - requests_sent, 1)
+        self.assertEqual(self.images.downloads, 1)
+
+            # small sources are not made wider
+        with Image.open(self.images.get(f'{self.stub.images_url}/event0-0/100.jpg', 640)) as image:
+            self.assertEqual(image.width, 100)
+
+
+    def test_not_allowed(self):
+        ''' tests images from other hosts and urls that are not images are not saved '''
+
+        requests_sent = self.stub.stats['requests']
+
+        self.assertIsNone(self.images.get('https://images.example.com/event0-0/2048.jpg', 320))
+        self.assertIsNone(self.images.get('file:///etc/passwd', 320))
+        self.assertEqual(self.stub.stats['requests'], requests_sent)
+
+        self.assertIsNone(self.images.get(f'{self.stub.url}/v1/me', 320))
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+
+    def test_failures_bounded(self):
+        ''' tests failed images are remembered up to max_failed and no per image locks are kept '''
+
+        images = ImageCache(self.cache_dir.name, http=self.http, allowed_hosts=['127.0.0.1'], max_failed=2)
+
+        for i in range(4):
+            self.assertIsNone(images.get(f'{self.stub.url}/v1/me?image={i}', 320))
+
+        self.assertEqual(len(images.failed.entries), 2)
+        self.assertEqual(images.url_locks, {})
+
+            # a remembered failure is not requested again
+        requests_sent = self.stub.stats['requests']
+        images.get(f'{self.stub.url}/v1/me?image=3', 320)
+
+        self.assertEqual(self.stub.stats['requests'], requests_sent)
+
+
+    def test_least_recently_used_removed(self):
+        ''' tests the cache stays under max_bytes by removing the variants used longest ago '''
+
+        first_url = f'{self.stub.images_url}/event0-0/1024.jpg'
+        first = self.images.get(first_url, 640)
+        self.images.max_bytes = sum(os.path.getsize(os.path.join(self.cache_dir.name, name)) for name in os.listdir(self.cache_dir.name)) * 2
+
+            # the first image is shown again after each new one, the second is never shown again.
+            # file times are only a few milliseconds precise, the sleeps keep them in order
+        for i in range(1, 4):
+            time.sleep(0.05)
+            self.images.get(f'{self.stub.images_url}/event{i}-0/1024.jpg', 640)
+            time.sleep(0.05)
+            self.assertEqual(self.images.get(first_url, 640), first)
+
+        sizes = [os.path.getsize(os.path.join(self.cache_dir.name, name)) for name in os.listdir(self.cache_dir.name)]
+
+        self.assertLessEqual(sum(sizes), self.images.max_bytes)
+        self.assertFalse(os.path.exists(self.images.path(f'{self.stub.images_url}/event1-0/1024.jpg', 640)))
+        self.assertEqual(self.images.downloads, 4)
+
+
+class PostalIndexTestCase(TestCase):
+    ''' Tests the memory mapped postal index against small postal data files '''
+
+    POSTAL_DATA = {
+        'US': [('90001', '33.9731', '-118.2479'), ('90001', '33.9751', '-118.2499'), ('10001', '40.7484', '-73.9967'), ('60601', '', '')],
+        'GB': [('SW1A', '51.5010', '-0.1416'), ('EC1A', '51.5200', '-0.0970')],
+        'CA': [('K1A', '45.4215', '-75.6972'), ('M5V', '43.6426', '-79.3871')]
+    }
+
+    def setUp(self):
+        ''' Points pgeocode and the postal indexes at a folder with only the small data files '''
+        self.storage_dir = tempfile.TemporaryDirectory()
+
+        for country_code, rows in self.POSTAL_DATA.items():
+            with open(os.path.join(self.storage_dir.name, f'{country_code}.txt'), 'w', encoding='utf-8') as file:
+                file.write('country_code,postal_code,place_name,latitude,longitude\n')
+                for postal_code, lat, long in rows:
+                    file.write(f'{country_code},{postal_code},Test Place,{lat},{long}\n')
+
+        self.saved = (pgeocode.STORAGE_DIR, geo.POSTAL_INDEX_DIR, dict(geo._indexes))
+        pgeocode.STORAGE_DIR = self.storage_dir.name
+        geo.POSTAL_INDEX_DIR = os.path.join(self.storage_dir.name, 'indexes')
+        geo._indexes.clear()
+
+
+    def tearDown(self):
+        ''' Puts the real postal data back '''
+        pgeocode.STORAGE_DIR, geo.POSTAL_INDEX_DIR, indexes = self.saved
+        geo._indexes.clear()
+        geo._indexes.update(indexes)
+        self.storage_dir.cleanup()
+
+
+    def test_lookup(self):
+        ''' tests codes in the data are found, places sharing a code are averaged and other codes are not found '''
+
+        index = geo.get_postal_index('us')
+
+        self.assertEqual(len(index), 2)
+        self.assertIs(geo.get_postal_index('US'), index)
+
+        lat, long = index.lookup('90001')
+        self.assertAlmostEqual(lat, 33.9741)
+        self.assertAlmostEqual(long, -118.2489)
+        self.assertEqual(index.lookup('10001'), (40.7484, -73.9967))
+
+            # places without coordinates are left out
+        self.assertIsNone(index.lookup('60601'))
+        self.assertIsNone(index.lookup('99999'))
+        self.assertIsNone(index.lookup('00000'))
+        self.assertIsNone(index.lookup('9' * 17))
+
+
+    def test_saved_index_reused(self):
+        ''' tests a saved index file is read without the postal data, and files that are not indexes are refused '''
+
+        geo.get_postal_index('US')
+        os.remove(os.path.join(self.storage_dir.name, 'US.txt'))
+        geo._indexes.clear()
+
+        self.assertEqual(geo.get_postal_index('US').lookup('10001'), (40.7484, -73.9967))
+
+        with self.assertRaises(ValueError):
+            geo.PostalIndex(os.path.join(self.storage_dir.name, 'GB.txt'))
+
+        with self.assertRaises(ValueError):
+            geo.get_postal_index('XX')
+
+
+    def test_normalize_postal_code(self):
+        ''' tests only the first part of GB, IE and CA postal codes is kept '''
+
+        self.assertEqual(geo.normalize_postal_code('GB', ' sw1a 1aa '), 'SW1A')
+        self.assertEqual(geo.normalize_postal_code('IE', 'd02 x285'), 'D02')
+        self.assertEqual(geo.normalize_postal_code('CA', 'k1a 0b1'), 'K1A')
+        self.assertEqual(geo.normalize_postal_code('GB', '   '), '')
+        self.assertEqual(geo.normalize_postal_code('US', ' 90001 '), '90001')
+        self.assertEqual(geo.normalize_postal_code('US', 90001), '90001')
+
+
+    def test_is_valid_zipcode(self):
+        ''' tests full GB and CA postal codes are found by their first part and unknown codes and countries are not valid '''
+
+        self.assertTrue(geo.is_valid_zipcode('GB', 'SW1A 1AA'))
+        self.assertTrue(geo.is_valid_zipcode('gb', 'ec1a 1bb'))
+        self.assertTrue(geo.is_valid_zipcode('CA', 'K1A 0B1'))
+        self.assertTrue(geo.is_valid_zipcode('US', '90001'))
+
+        self.assertFalse(geo.is_valid_zipcode('GB', 'W1A 0AX'))
+        self.assertFalse(geo.is_valid_zipcode('CA', 'H0H 0H0'))
+        self.assertFalse(geo.is_valid_zipcode('US', '99999'))
+        self.assertFalse(geo.is_valid_zipcode('XX', '90001'))
+
+        self.assertEqual(geo.get_lat_long('CA', 'M5V 3L9'), (43.6426, -79.3871))
+        self.assertEqual(geo.get_lat_long('US', '99999'), (None, None))
@@ -1,7 +1,8 @@
 import os
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
-from models import db, User, Artist, UserArtist, Event, UserEvent, WishList, CreateEvent
+from datetime import timedelta, date
+from models import db, User, Artist, UserArtist, Event, UserEvent, WishList, CreateEvent, AttractionLookup, Venue, SpotifyProfile, utc_now
 
 os.environ['DATABASE_URL'] = "postgresql:///artists_test"
 
@@ -194,7 +195,9 @@ class ArtistModelTestCase(TestCase):
     def tearDown(self):
         ''' Confirms all data is removed after test runs'''
         with app.app_context():
+            UserArtist.query.delete()
             Artist.query.delete()
+            User.query.delete()
 
             db.session.commit()
 
@@ -232,6 +235,29 @@ class ArtistModelTestCase(TestCase):
             db.session.rollback()
 
 
+    def test_get_stale(self):
+        ''' tests only artists not refreshed within max_age are returned, most followed first then refreshed longest ago'''
+
+        with app.app_context():
+            users = [User(name='Test User', username=f'TestUsername{i}', email=f'TestEmail{i}@test.com', password='TestPassword', country='United States of America', country_code='US', zipcode='90001') for i in range(2)]
+            db.session.add_all(users)
+
+            now = utc_now()
+            refreshed_at = {'one_follower': None, 'two_followers': now - timedelta(hours=7), 'no_followers': None, 'fresh': now - timedelta(hours=1), 'old': now - timedelta(hours=10)}
+            artists = {name: Artist(name=name, spotify_id=name, spotify_url=f'testurl.api/{name}', image='', attraction_id=name, events_refreshed_at=refreshed) for name, refreshed in refreshed_at.items()}
+            db.session.add_all(artists.values())
+            db.session.flush()
+
+            for name, followers in (('one_follower', users[:1]), ('two_followers', users), ('fresh', users)):
+                db.session.add_all([UserArtist(user_id=user.id, artist_id=artists[name].id) for user in followers])
+            db.session.commit()
+
+            self.assertEqual([artist.name for artist in Artist.get_stale(timedelta(hours=6))], ['two_followers', 'one_follower', 'no_followers', 'old'])
+            self.assertEqual([artist.name for artist in Artist.get_stale(timedelta(hours=6), limit=2)], ['two_followers', 'one_follower'])
+            self.assertEqual([artist.name for artist in Artist.get_stale(timedelta(minutes=30))], ['two_followers', 'fresh', 'one_follower', 'no_followers', 'old'])
+            self.assertEqual([artist.name for artist in Artist.get_stale(timedelta(hours=12))], ['one_follower', 'no_followers'])
+
+
 class UserArtistModelTestCase(TestCase):
     ''' Tests the user model '''
 
@@ -292,3 +318,346 @@ class UserArtistModelTestCase(TestCase):
             self.assertTrue(ua)
             self.assertEqual(ua.user_id, u.id)
 
+
+    def test_set_user_artists(self):
+        ''' tests syncing a users artists adds new artists in bulk and only changes rows that moved'''
+
+        with app.app_context():
+            u = User(name='Test Name', username='TestUsername', email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+
+            artists = [{'name': f'artist{i}', 'spotify_id': f'0000{i}', 'spotify_url': f'testurl.api/artist{i}', 'image_url': '', 'attraction_id': f'0000{i}'} for i in range(4)]
+
+            artist_ids = Artist.add_artists(artists[:3])
+            db.session.commit()
+
+            self.assertEqual(UserArtist.set_user_artists(u.id, {artist_ids['00000']: 1, artist_ids['00001']: 2, artist_ids['00002']: 3}), (3, 0, 0))
+            db.session.commit()
+
+                # the same artists again only updates images and changes nothing for the user
+            artists[1]['image_url'] = 'testurl.api/artist1.jpg'
+            artist_ids = Artist.add_artists(artists[1:])
+            db.session.commit()
+
+            self.assertEqual(Artist.query.count(), 4)
+            self.assertEqual(Artist.query.filter_by(spotify_id='00001').first().image, 'testurl.api/artist1.jpg')
+
+            self.assertEqual(UserArtist.set_user_artists(u.id, {artist_ids['00003']: 1, artist_ids['00001']: 2, artist_ids['00002']: 4}), (1, 1, 1))
+            db.session.commit()
+
+            self.assertEqual([artist.spotify_id for artist in u.artists], ['00003', '00001', '00002'])
+
+
+class SpotifyProfileModelTestCase(TestCase):
+    ''' tests spotify profile model'''
+
+    def setUp(self):
+        ''' Clears all data '''
+        with app.app_context():
+            SpotifyProfile.query.delete()
+            User.query.delete()
+
+            db.session.commit()
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        with app.app_context():
+            SpotifyProfile.query.delete()
+            User.query.delete()
+
+            db.session.commit()
+
+
+    def test_save_and_is_fresh(self):
+        ''' tests saving a profile twice updates it and it goes stale after the ttl'''
+
+        with app.app_context():
+            u = User(name='Test Name', username='TestUsername', email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+
+            SpotifyProfile.save(u.id, [{'name': 'artist1'}], [{'name': 'track1', 'artist': 'artist1', 'image_url': ''}])
+            db.session.commit()
+            SpotifyProfile.save(u.id, [{'name': 'artist2'}], [])
+            db.session.commit()
+
+            profile = db.session.get(SpotifyProfile, u.id)
+
+            self.assertEqual(SpotifyProfile.query.count(), 1)
+            self.assertEqual(profile.top_artists, [{'name': 'artist2'}])
+            self.assertTrue(profile.is_fresh(timedelta(hours=1)))
+
+            profile.fetched_at = utc_now() - timedelta(hours=2)
+            db.session.commit()
+
+            self.assertFalse(profile.is_fresh(timedelta(hours=1)))
+
+
+class AttractionLookupModelTestCase(TestCase):
+    ''' tests attraction lookup model'''
+
+    def setUp(self):
+        ''' Clears all data '''
+        with app.app_context():
+            AttractionLookup.query.delete()
+
+            db.session.commit()
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        with app.app_context():
+            AttractionLookup.query.delete()
+
+            db.session.commit()
+
+
+    def test_record_and_get_fresh(self):
+        ''' tests saving found and missing lookups and getting them back'''
+
+        with app.app_context():
+            AttractionLookup.record('00000', 'testurl.api/artist1', 'K0000')
+            AttractionLookup.record('00001', 'testurl.api/artist2', None)
+            db.session.commit()
+
+            lookups = AttractionLookup.get_fresh(['00000', '00001', '00002'])
+
+            self.assertEqual(len(lookups), 2)
+            self.assertEqual(lookups['00000'].attraction_id, 'K0000')
+            self.assertIsNone(lookups['00001'].attraction_id)
+
+
+    def test_missing_lookup_expires_first(self):
+        ''' tests misses use the shorter ttl'''
+
+        with app.app_context():
+            found = AttractionLookup.record('00000', 'testurl.api/artist1', 'K0000')
+            missing = AttractionLookup.record('00001', 'testurl.api/artist2', None)
+
+            found.resolved_at = utc_now() - AttractionLookup.MISSING_TTL - timedelta(minutes=1)
+            missing.resolved_at = utc_now() - AttractionLookup.MISSING_TTL - timedelta(minutes=1)
+            db.session.commit()
+
+            lookups = AttractionLookup.get_fresh(['00000', '00001'])
+
+            self.assertIn('00000', lookups)
+            self.assertNotIn('00001', lookups)
+
+
+class EventModelTestCase(TestCase):
+    ''' tests event model'''
+
+    def setUp(self):
+        ''' Clears all data '''
+        with app.app_context():
+            Event.query.delete()
+            Venue.query.delete()
+            Artist.query.delete()
+
+            db.session.commit()
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        with app.app_context():
+            Event.query.delete()
+            Venue.query.delete()
+            Artist.query.delete()
+
+            db.session.commit()
+
+
+    def _event_data(self, event_id, artist='artist1', date=None):
+        ''' helper method to create parsed event data'''
+
+        return {'event_id': event_id, 'name': f'test event {event_id}', 'artist': artist, 'url': 'http://example.com/event', 'image': 'http://example.com/event.jpg', 'date': date, 'location': 'Los Angeles, California'}
+
+
+    def test_add_events(self):
+        ''' tests adding a batch of events skips duplicates and saved events'''
+
+        with app.app_context():
+            added = Event.add_events([self._event_data('00000'), self._event_data('00001'), self._event_data('00000')])
+            db.session.commit()
+
+            self.assertEqual(added, 2)
+            self.assertEqual(Event.query.count(), 2)
+
+            added = Event.add_events([self._event_data('00001'), self._event_data('00002')])
+            db.session.commit()
+
+            self.assertEqual(added, 1)
+            self.assertEqual(Event.query.count(), 3)
+
+
+    def test_get_condensed_events(self):
+        ''' tests condensed events keep the artist order, the per artist limit and the total limit'''
+
+        with app.app_context():
+            artists = [Artist(name=f'artist{i}', spotify_id=f'0000{i}', spotify_url=f'testurl.api/artist{i}', image='', attraction_id=f'0000{i}') for i in range(4)]
+            db.session.add_all(artists)
+            db.session.commit()
+
+            a0, a1, a2, a3 = [artist.id for artist in artists]
+            today = date.today()
+            Event.add_events([
+                dict(self._event_data('00000', 'artist1', today + timedelta(days=3)), artist_id=a1),
+                dict(self._event_data('00001', 'artist1', today + timedelta(days=1)), artist_id=a1),
+                dict(self._event_data('00002', 'artist1', today + timedelta(days=2)), artist_id=a1),
+                dict(self._event_data('00003', 'artist1', today - timedelta(days=2)), artist_id=a1),
+                dict(self._event_data('00004', 'artist2', None), artist_id=a2),
+                dict(self._event_data('00005', 'artist2', today + timedelta(days=5)), artist_id=a2),
+                self._event_data('00006', 'artist3', today + timedelta(days=5))
+            ])
+            db.session.commit()
+
+                # links the event that was saved without an artist
+            Event.add_events([dict(self._event_data('00006', 'artist3'), artist_id=a3)])
+            db.session.commit()
+
+            ordered = [artists[2], artists[1], artists[0], artists[3]]
+            events = Event.get_condensed_events(ordered)
+
+            self.assertEqual([[event.event_id for event in group] for group in events], [['00005', '00004'], ['00001', '00002'], ['00006']])
+
+            events = Event.get_condensed_events(ordered, max_events=3, per_artist=1)
+
+            self.assertEqual([[event.event_id for event in group] for group in events], [['00005'], ['00001'], ['00006']])
+
+                # every artist keeps its first event before any artist gets a second one
+            events = Event.get_condensed_events(ordered, max_events=4)
+
+            self.assertEqual([[event.event_id for event in group] for group in events], [['00005', '00004'], ['00001'], ['00006']])
+
+
+    def test_get_condensed_events_all_artists(self):
+        ''' tests the total limit keeps every artist when there are more artists than max_events / per_artist'''
+
+        with app.app_context():
+            artists = [Artist(name=f'artist{i}', spotify_id=f'0000{i}', spotify_url=f'testurl.api/artist{i}', image='', attraction_id=f'0000{i}') for i in range(10)]
+            db.session.add_all(artists)
+            db.session.commit()
+
+            today = date.today()
+            Event.add_events([dict(self._event_data(f'{i}-{j}', f'artist{i}', today + timedelta(days=j + 1)), artist_id=artist.id) for i, artist in enumerate(artists) for j in range(2)])
+            db.session.commit()
+
+            events = Event.get_condensed_events(artists, max_events=16)
+
+            self.assertEqual(len(events), 10)
+            self.assertEqual([len(group) for group in events], [2] * 6 + [1] * 4)
+            self.assertEqual([group[0].event_id for group in events], [f'{i}-0' for i in range(10)])
+
+
+    def test_get_near(self):
+        ''' tests nearby events are filtered by exact distance, keep one event per artist and skip past events'''
+
+        with app.app_context():
+            today = date.today()
+            venues = {
+                    # downtown los angeles, santa monica, san diego is about 110 miles away
+                'la': {'id': 'venue_la', 'name': 'LA Arena', 'city': 'Los Angeles', 'state': 'California', 'latitude': 34.0430, 'longitude': -118.2673},
+                'sm': {'id': 'venue_sm', 'name': 'SM Hall', 'city': 'Santa Monica', 'state': 'California', 'latitude': 34.0195, 'longitude': -118.4912},
+                'sd': {'id': 'venue_sd', 'name': 'SD Hall', 'city': 'San Diego', 'state': 'California', 'latitude': 32.7157, 'longitude': -117.1611}
+            }
+            for venue in venues.values():
+                venue['geohash'] = CreateEvent({}).create_venue({'id': venue['id'], 'location': {'latitude': venue['latitude'], 'longitude': venue['longitude']}}, None, None)['geohash']
+
+            Event.add_events([
+                dict(self._event_data('00000', 'artist1', today + timedelta(days=3)), venue_id='venue_la', venue=venues['la']),
+                dict(self._event_data('00001', 'artist1', today + timedelta(days=1)), venue_id='venue_sm', venue=venues['sm']),
+                dict(self._event_data('00002', 'artist2', today + timedelta(days=2)), venue_id='venue_sm', venue=venues['sm']),
+                dict(self._event_data('00003', 'artist3', today - timedelta(days=2)), venue_id='venue_la', venue=venues['la']),
+                dict(self._event_data('00004', 'artist4', today + timedelta(days=1)), venue_id='venue_sd', venue=venues['sd'])
+            ])
+            db.session.commit()
+
+            self.assertEqual(Venue.query.count(), 3)
+
+            events = Event.get_near(34.0522, -118.2437, radius=50)
+
+            self.assertEqual([event.event_id for event in events], ['00001', '00002'])
+
+            events = Event.get_near(34.0522, -118.2437, radius=150, unique_artists=False)
+
+            self.assertEqual([event.event_id for event in events], ['00001', '00004', '00002', '00000'])
+
+
+class WishListModelTestCase(TestCase):
+    ''' tests wishlist model'''
+
+    def setUp(self):
+        ''' Clears all data '''
+        with app.app_context():
+            WishList.query.delete()
+            Event.query.delete()
+            User.query.delete()
+
+            db.session.commit()
+
+
+    def tearDown(self):
+        ''' Confirms all data is removed after test runs'''
+        with app.app_context():
+            WishList.query.delete()
+            Event.query.delete()
+            User.query.delete()
+
+            db.session.commit()
+
+
+    def _add_wishlist(self, dates):
+        ''' helper method to add a user with one wishlisted event for each date, returns the users id'''
+
+        u = User(name='Test Name', username='TestUsername', email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001')
+        db.session.add(u)
+        db.session.commit()
+
+        Event.add_events([{'event_id': f'0000{i}', 'name': f'test event {i}', 'artist': 'artist1', 'url': 'http://example.com/event', 'image': 'http://example.com/event.jpg', 'date': event_date, 'location': 'Los Angeles, California'} for i, event_date in enumerate(dates)])
+        db.session.add_all([WishList(user_id=u.id, event_id=f'0000{i}') for i in range(len(dates))])
+        db.session.commit()
+
+        return u.id
+
+
+    def test_get_page(self):
+        ''' tests pages follow (date, event id) with TBA events last, never repeat or skip events and past events are newest first'''
+
+        with app.app_context():
+            today = date.today()
+            user_id = self._add_wishlist([today + timedelta(days=2), None, today - timedelta(days=1), today + timedelta(days=2), today - timedelta(days=5), None, today])
+
+            event_ids = []
+            events, cursor = WishList.get_page(user_id, limit=3)
+            pages = 1
+            while True:
+                event_ids += [event.event_id for event in events]
+                if not cursor:
+                    break
+                events, cursor = WishList.get_page(user_id, after=cursor, limit=3)
+                pages += 1
+
+            self.assertEqual(event_ids, ['00004', '00002', '00006', '00000', '00003', '00001', '00005'])
+            self.assertEqual(pages, 3)
+            self.assertEqual(WishList.count_events(user_id), 7)
+
+            events, cursor = WishList.get_page(user_id, limit=10, when='upcoming')
+
+            self.assertEqual([event.event_id for event in events], ['00006', '00000', '00003', '00001', '00005'])
+            self.assertIsNone(cursor)
+            self.assertEqual(WishList.count_events(user_id, when='upcoming'), 5)
+
+            events, cursor = WishList.get_page(user_id, limit=1, when='past')
+            events += WishList.get_page(user_id, after=cursor, limit=1, when='past')[0]
+
+            self.assertEqual([event.event_id for event in events], ['00002', '00004'])
+            self.assertEqual(WishList.count_events(user_id, when='past'), 2)
+
+            self.assertEqual(WishList.get_wishlisted(user_id, ['00001', '00003', 'not wishlisted']), {'00001', '00003'})
+
+            with self.assertRaises(ValueError):
+                WishList.get_page(user_id, after='not a cursor')
+            with self.assertRaises(ValueError):
+                WishList.get_page(user_id, when='someday')
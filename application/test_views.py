@@ -1,10 +1,17 @@
 import os
+import time
+import threading
+from datetime import date, timedelta, timezone
+from sqlalchemy import event as sa_event
 from unittest import TestCase
-from models import db, User, Artist, UserArtist, Event, UserEvent, WishList, CreateEvent
+from models import db, bcrypt, User, Artist, UserArtist, Event, UserEvent, WishList, CreateEvent, SpotifyProfile, SpotifyToken, utc_now
 
 os.environ['DATABASE_URL'] = "postgresql:///artists_test"
 
-from app import app
+from app import app, invalidate_page_cache, spotify, spotify_tokens, ticketmaster, refreshing_artists, refreshing_lock, EVENTS_MAX_AGE
+from ticketmaster import TicketmasterError
+from rate_limit import RateLimiter
+from stub_server import StubServer
 app.config['WTF_CSRF_ENABLED'] = False
 
 with app.app_context():
@@ -73,6 +80,94 @@ class ViewsTestCase(TestCase):
             self.assertIn('Hello, you should login for a personal experience', html)
 
 
+    def test_homepage_cached(self):
+        ''' tests the logged out homepage is cached for everyone and the csrf token is fetched separately'''
+
+        with app.app_context():
+            invalidate_page_cache()
+
+            res = self.client.get('/')
+            html = res.get_data(as_text=True)
+
+            self.assertIn('max-age=0', res.headers['Cache-Control'])
+            self.assertIn('s-maxage', res.headers['Cache-Control'])
+            self.assertIn('Cookie', res.headers['Vary'])
+            self.assertIn('data-csrf-token', html)
+
+            res = self.client.get('/', headers={'If-None-Match': res.get_etag()[0]})
+
+            self.assertEqual(res.status_code, 304)
+
+            res = self.client.get('/csrf-token')
+
+            self.assertEqual(res.headers['Cache-Control'], 'no-store')
+            self.assertTrue(res.json['csrf_token'])
+
+
+    def test_homepage_rate_limited(self):
+        ''' tests the homepage still renders with empty carousels while ticketmaster rate limits every request or the daily quota is used up'''
+
+        with app.app_context(), StubServer(rate_limit_rate=1.0) as stub:
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001', latitude=34.0, longitude=-118.2, geohash='9q5c')
+            db.session.add(u)
+            db.session.commit()
+            user_id = u.id
+
+            saved = (ticketmaster.base_url, ticketmaster.rate_limiter)
+            ticketmaster.base_url = stub.ticketmaster_url
+                # the stubs Retry-After is longer than max_retry_after so requests fail right away
+            ticketmaster.rate_limiter = RateLimiter(max_retry_after=0)
+
+            try:
+                for quota_used_up in (False, True):
+                    if quota_used_up:
+                        ticketmaster.rate_limiter.quota_remaining = 0
+                        ticketmaster.rate_limiter.quota_reset_at = time.time() + 3600
+
+                    invalidate_page_cache()
+                    ticketmaster.generic_events_cache.invalidate(everything=True)
+
+                    res = self.client.get('/')
+
+                    self.assertEqual(res.status_code, 200)
+                    self.assertIn('Hello, you should login for a personal experience', res.get_data(as_text=True))
+
+                    with self.client.session_transaction() as sess:
+                        sess['user id'] = user_id
+
+                    self.assertEqual(self.client.get('/').status_code, 200)
+
+                    with self.client.session_transaction() as sess:
+                        del sess['user id']
+            finally:
+                ticketmaster.base_url, ticketmaster.rate_limiter = saved
+                ticketmaster.generic_events_cache.invalidate(everything=True)
+                invalidate_page_cache()
+
+
+    def test_homepage_after_login(self):
+        ''' tests logging in after seeing the cached logged out homepage shows the users homepage'''
+
+        with app.app_context():
+            invalidate_page_cache()
+
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password=bcrypt.generate_password_hash(self.password).decode('UTF-8'), country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+
+            res = self.client.get('/')
+
+            self.assertIn('Hello, you should login for a personal experience', res.get_data(as_text=True))
+
+            self.client.post('/login', data={'username': self.username, 'password': self.password})
+            res = self.client.get('/', headers={'If-None-Match': res.get_etag()[0]})
+            html = res.get_data(as_text=True)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn('(Connect Spotify to See)', html)
+            self.assertNotIn('Hello, you should login for a personal experience', html)
+
+
     def test_homepage_with_user(self):
         ''' tests homepage with a logged in user '''
 
@@ -207,6 +302,45 @@ class ViewsTestCase(TestCase):
             self.assertIn('event removed from wishlist', html)
 
 
+    def test_wishlist_pages(self):
+        ''' test the wishlist is returned a page at a time with a total, for json and html'''
+
+        with app.app_context():
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+
+            Event.add_events([{'event_id': f'0000{i}', 'name': f'test event {i}', 'artist': 'artist1', 'url': 'http://example.com/event', 'image': 'http://example.com/event.jpg', 'date': None, 'location': 'Los Angeles, California'} for i in range(5)])
+            db.session.add_all([WishList(user_id=u.id, event_id=f'0000{i}') for i in range(5)])
+            db.session.commit()
+
+            with self.client.session_transaction() as sess:
+                sess['user id'] = u.id
+
+            res = self.client.get('/get-wishlist?limit=2')
+            page = res.get_json()
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([event['event_id'] for event in page['events']], ['00000', '00001'])
+            self.assertTrue(page['events'][0]['wishlisted'])
+            self.assertEqual(page['total'], 5)
+
+            page = self.client.get(f'/get-wishlist?limit=2&after={page["next"]}').get_json()
+
+            self.assertEqual([event['event_id'] for event in page['events']], ['00002', '00003'])
+
+            self.assertEqual(self.client.get('/get-wishlist?when=someday').status_code, 400)
+
+            res = self.client.get('/user/wishlist?limit=2')
+            html = res.get_data(as_text=True)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn('test event 1', html)
+            self.assertNotIn('test event 2', html)
+            self.assertIn('5 events', html)
+            self.assertIn('Next Page', html)
+
+
     def test_logout(self):
         ''' test logging out of account'''
 
@@ -217,4 +351,256 @@ class ViewsTestCase(TestCase):
             html = res.get_data(as_text=True)
 
             self.assertEqual(res.status_code, 200)
-            self.assertIn('Hello, you should login for a personal experience', html)       
\ No newline at end of file
+            self.assertIn('Hello, you should login for a personal experience', html)       
+
+    def test_callback_sync_failure(self):
+        ''' tests a failed artist sync does not save the spotify profile, so connecting again syncs the artists'''
+
+        with app.app_context(), StubServer() as stub:
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+            user_id = u.id
+
+            with self.client.session_transaction() as sess:
+                sess['user id'] = user_id
+
+            urls = (spotify.base_url, spotify.token_url, ticketmaster.base_url)
+            spotify.base_url, spotify.token_url, ticketmaster.base_url = stub.spotify_url, stub.token_url, stub.ticketmaster_url
+
+            def fail(*args, **kwargs):
+                raise TicketmasterError('stub failure')
+
+            try:
+                ticketmaster.set_up_artists = fail
+                res = self.client.get('/callback?code=stub')
+
+                self.assertEqual(res.status_code, 302)
+                self.assertIsNone(db.session.get(SpotifyProfile, user_id))
+
+                del ticketmaster.set_up_artists
+                self.client.get('/callback?code=stub')
+
+                self.assertIsNotNone(db.session.get(SpotifyProfile, user_id))
+                self.assertEqual(UserArtist.query.filter_by(user_id=user_id).count(), 10)
+            finally:
+                ticketmaster.__dict__.pop('set_up_artists', None)
+                spotify.base_url, spotify.token_url, ticketmaster.base_url = urls
+                spotify_tokens.tokens.invalidate(user_id)
+                SpotifyProfile.query.delete()
+                SpotifyToken.query.delete()
+                db.session.commit()
+
+
+    def test_homepage_refreshes_spotify_profile(self):
+        ''' tests an old spotify profile is fetched again on the homepage with the token refreshed by the token manager'''
+
+        with app.app_context(), StubServer() as stub:
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001', latitude=34.0, longitude=-118.2, geohash='9q5c')
+            db.session.add(u)
+            db.session.commit()
+            user_id = u.id
+
+            SpotifyToken.save(user_id, {'access_token': 'expired', 'refresh_token': 'refresh', 'expires_at': int(time.time()) - 10})
+            SpotifyProfile.save(user_id, [], []).fetched_at = utc_now() - timedelta(days=30)
+            db.session.commit()
+
+            with self.client.session_transaction() as sess:
+                sess['user id'] = user_id
+                sess['spotify_token'] = True
+
+            urls = (spotify.base_url, spotify.token_url, ticketmaster.base_url)
+            spotify.base_url, spotify.token_url, ticketmaster.base_url = stub.spotify_url, stub.token_url, stub.ticketmaster_url
+                # the token is only saved in the data base, like after a restart
+            spotify_tokens.tokens.invalidate(user_id)
+            refreshes = spotify_tokens.refreshes
+
+            try:
+                res = self.client.get('/')
+
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(spotify_tokens.refreshes - refreshes, 1)
+                self.assertNotEqual(db.session.get(SpotifyToken, user_id).access_token, 'expired')
+                self.assertTrue(db.session.get(SpotifyProfile, user_id).top_artists)
+                self.assertEqual(UserArtist.query.filter_by(user_id=user_id).count(), 10)
+            finally:
+                spotify.base_url, spotify.token_url, ticketmaster.base_url = urls
+                spotify_tokens.tokens.invalidate(user_id)
+                SpotifyProfile.query.delete()
+                SpotifyToken.query.delete()
+                db.session.commit()
+
+
+    def _add_artists_with_events(self, user_id, start, count):
+        ''' adds count artists in the users top artists, each with two upcoming events and one of them on the users wishlist'''
+
+        for i in range(start, start + count):
+            artist = Artist(name=f'artist{i}', spotify_id=f'spotify{i}', spotify_url=f'http://example.com/artist{i}', image='http://example.com/artist.jpg', attraction_id=f'attraction{i}', events_refreshed_at=utc_now())
+            db.session.add(artist)
+            db.session.flush()
+
+            db.session.add(UserArtist(user_id=user_id, artist_id=artist.id, rank=i + 1))
+            for j in range(2):
+                db.session.add(Event(event_id=f'{i}-{j}', name=f'test event {i}-{j}', artist=artist.name, artist_id=artist.id, url='http://example.com/event', image='http://example.com/event.jpg', date=date.today() + timedelta(days=j + 1), location='Los Angeles, California'))
+            db.session.add(WishList(user_id=user_id, event_id=f'{i}-0'))
+        db.session.commit()
+
+
+    def _count_statements(self, url):
+        ''' requests a url and returns the response and how many sql statements it ran'''
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+            # requests share the tests session, it is emptied so nothing is found without a statement
+        db.session.expunge_all()
+
+        sa_event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            res = self.client.get(url)
+        finally:
+            sa_event.remove(db.engine, 'before_cursor_execute', count)
+        return res, len(statements)
+
+
+    def test_statement_counts(self):
+        ''' tests the homepage and top artists events run the same few sql statements however many artists and wishlisted events the user has'''
+
+        with app.app_context(), StubServer() as stub:
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001', latitude=34.0, longitude=-118.2, geohash='9q5c')
+            db.session.add(u)
+            db.session.commit()
+            user_id = u.id
+
+            SpotifyProfile.save(user_id, [], [{'name': 'track', 'artist': 'artist0', 'image_url': 'http://example.com/track.jpg'}])
+            self._add_artists_with_events(user_id, 0, 2)
+
+            with self.client.session_transaction() as sess:
+                sess['user id'] = user_id
+                sess['spotify_token'] = True
+
+            ticketmaster_url = ticketmaster.base_url
+            ticketmaster.base_url = stub.ticketmaster_url
+
+            try:
+                    # the first requests save the nearby events from ticketmaster
+                self.client.get('/')
+                self.client.get('/top-artists-events')
+
+                counts = {}
+                for url in ('/', '/top-artists-events'):
+                    res, counts[url] = self._count_statements(url)
+                    self.assertEqual(res.status_code, 200)
+
+                self.assertEqual(len(self.client.get('/top-artists-events').get_json()['events']), 2)
+
+                self._add_artists_with_events(user_id, 2, 20)
+
+                for url in ('/', '/top-artists-events'):
+                    res, statements = self._count_statements(url)
+
+                    self.assertEqual(res.status_code, 200)
+                    self.assertEqual(statements, counts[url])
+                    self.assertLessEqual(statements, 8)
+            finally:
+                ticketmaster.base_url = ticketmaster_url
+                SpotifyProfile.query.delete()
+                db.session.commit()
+
+
+    def test_top_artists_events_refresh(self):
+        ''' tests top artists events answer from the data base with an as_of time while a stale artist is refreshed in the background once'''
+
+        with app.app_context():
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password='TestPassword', country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+            user_id = u.id
+
+            with self.client.session_transaction() as sess:
+                sess['user id'] = user_id
+                sess['spotify_token'] = True
+
+            self.assertEqual(self.client.get('/top-artists-events').get_json(), {'as_of': None, 'refreshing': False, 'events': []})
+
+            self._add_artists_with_events(user_id, 0, 2)
+            stale = Artist.query.filter_by(spotify_id='spotify0').one()
+            stale.events_refreshed_at = utc_now() - EVENTS_MAX_AGE - timedelta(hours=1)
+            stale_id, as_of = stale.id, stale.events_refreshed_at.replace(tzinfo=timezone.utc).isoformat()
+            db.session.commit()
+
+            refreshed = []
+            release = threading.Event()
+
+            def add_events_to_db(artists):
+                refreshed.append([artist.id for artist in artists])
+                release.wait(5)
+
+            try:
+                ticketmaster.add_events_to_db = add_events_to_db
+
+                first = self.client.get('/top-artists-events').get_json()
+                second = self.client.get('/top-artists-events').get_json()
+
+                release.set()
+                for _ in range(50):
+                    with refreshing_lock:
+                        if not refreshing_artists:
+                            break
+                    time.sleep(0.1)
+            finally:
+                release.set()
+                del ticketmaster.add_events_to_db
+
+            self.assertEqual(refreshed, [[stale_id]])
+
+            for payload in (first, second):
+                self.assertEqual(payload['as_of'], as_of)
+                self.assertTrue(payload['refreshing'])
+                self.assertEqual([[event['event_id'] for event in pair] for pair in payload['events']], [['0-0', '1-0'], ['0-1', '1-1']])
+                self.assertEqual([event['wishlisted'] for event in payload['events'][0]], [True, True])
+                self.assertEqual([event['wishlisted'] for event in payload['events'][1]], [False, False])
+
+
+    def test_session_id_regenerated(self):
+        ''' tests the session gets a new id when logging in and logging out'''
+
+        with app.app_context():
+            u = User(name='Test Name', username=self.username, email='TestEmail@test.com', password=bcrypt.generate_password_hash(self.password).decode('UTF-8'), country='US', zipcode='90001')
+            db.session.add(u)
+            db.session.commit()
+
+            self.client.get('/csrf-token')
+            anonymous_id = self.client.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+
+            self.client.post('/login', data={'username': self.username, 'password': self.password})
+            login_id = self.client.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+
+            self.assertNotEqual(login_id, anonymous_id)
+
+            self.client.get('/logout')
+            logout_cookie = self.client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+
+            self.assertTrue(logout_cookie is None or logout_cookie.value != login_id)
+
+
+    def test_server_side_session(self):
+        ''' tests session data is stored on the server and the cookie only holds the session id'''
+
+        with app.app_context():
+            with self.client.session_transaction() as sess:
+                sess['spotify_token'] = {'access_token': 'test_access_token' * 20, 'refresh_token': 'test_refresh_token'}
+                sess['top_tracks'] = [{'name': 'track1', 'artist': 'artist1', 'image_url': 'http://example.com/track1.jpg'}] * 10
+
+            cookie = self.client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+
+            self.assertNotIn('test_access_token', cookie.value)
+            self.assertLess(len(cookie.value), 100)
+
+            self.client.get('/logout')
+
+            with self.client.session_transaction() as sess:
+                self.assertNotIn('spotify_token', sess)
+                self.assertNotIn('top_tracks', sess)
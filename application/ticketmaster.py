@@ -1,30 +1,122 @@
-import requests
-from models import CreateEvent, Event
+import time
+from contextlib import closing
+from requests import RequestException
+from concurrent.futures import ThreadPoolExecutor
+from models import Event, Artist, AttractionLookup, utc_now
+from event_parser import parse_page, parse_page_info
 from app import db
+from http_client import get_http_client
+from rate_limit import RateLimiter, RateLimitError
+from cache import TTLCache
+
+
+class TicketmasterError(Exception):
+    ''' raised when a discovery api request fails, answers with an error status or returns a body that can not be read '''
+
+
+    # marks an attraction lookup that was rate limited or failed, different from None which means ticketmaster answered and does not know the artist
+LOOKUP_FAILED = object()
+
+    # the discovery api does not return results past the 1000th (page * size)
+DEEP_PAGING_LIMIT = 1000
+
+    # server errors that are retried, each retry waits for the rate limiter like any other request
+SERVER_ERRORS = (500, 502, 503, 504)
 
 
 class TicketmasterAPI:
     ''' sets up ticketmaster class to handle all ticketmaster functions '''
 
-    def __init__(self, api_key, base_url="https://app.ticketmaster.com/discovery/v2"):
+    def __init__(self, api_key, base_url="https://app.ticketmaster.com/discovery/v2", http=None, max_workers=10, rate_limiter=None, generic_events_cache=None, geohash_precision=4, page_size=50, max_pages=5, server_error_retries=2, server_error_backoff=0.3):
         self.api_key = api_key
         self.base_url = base_url
-    
+        self._http = http
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter()
+            # 5xx responses are retried here instead of by the http client so every attempt is paced and counted
+        self.server_error_retries = server_error_retries
+        self.server_error_backoff = server_error_backoff
+
+            # events.json paging, see paginate_events
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._prefetch_executor = None
+
+            # generic events are shared by everyone in the same area, geohash_precision 4 is about 40km x 20km
+        self.generic_events_cache = generic_events_cache or TTLCache(maxsize=256, ttl=3600)
+        self.geohash_precision = geohash_precision
+
+
+    @property
+    def http(self):
+        ''' returns the http client passed in, or the shared pooled client for this worker '''
+
+        return self._http or get_http_client()
+
+
+    @property
+    def prefetch_executor(self):
+        ''' returns the threads used to request the next page of events, made the first time they are needed '''
+
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ticketmaster-prefetch')
+        return self._prefetch_executor
+
+
+    @property
+    def remaining_quota(self):
+        ''' returns how many discovery api requests are left for the day, None before the first response '''
+
+        return self.rate_limiter.remaining_quota
+
+
+    def request(self, path, params):
+        ''' sends a GET to the discovery api paced by the rate limiter. retries 429 and 5xx responses with backoff, every attempt takes a token from the rate limiter. raises RateLimitError if still limited and TicketmasterError if the request fails or answers with any other error status '''
+
+        rate_limited = 0
+        server_errors = 0
+
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                    # the http client does not retry 5xx responses here, they would skip the rate limiter
+                res = self.http.get(f'{self.base_url}/{path}', params=params, retry_status=False)
+            except RequestException as e:
+                raise TicketmasterError(f'request to {path} failed: {e}') from e
+            self.rate_limiter.update_from_headers(res.headers)
+
+            if res.status_code == 429:
+                if rate_limited >= self.rate_limiter.max_retries:
+                    raise RateLimitError(f'Still rate limited after {self.rate_limiter.max_retries} retries')
+
+                time.sleep(self.rate_limiter.backoff(rate_limited, res.headers.get('Retry-After')))
+                rate_limited += 1
+                continue
+
+            if res.status_code in SERVER_ERRORS and server_errors < self.server_error_retries:
+                time.sleep(self.server_error_backoff * 2 ** server_errors)
+                server_errors += 1
+                continue
 
-    def set_up_artists(self, artists):
-        ''' takes in raw artist data and parses info to create a simplier artist object'''
+            if not res.ok:
+                raise TicketmasterError(f'{path} answered {res.status_code}')
+            return res
+
+
+    def set_up_artists(self, artists, concurrent=True):
+        ''' takes in raw artist data and parses info to create a simplier artist object. attraction ids come from the data base when known, the rest are looked up at the same time unless concurrent is False '''
 
         if artists:
             artists_setup = []
-            for artist in artists:
+            attraction_ids = self.resolve_attraction_ids(artists, concurrent=concurrent)
+
+            for artist, attraction_id in zip(artists, attraction_ids):
                     # gets all data from each artist
                 name = artist.get('name', None)
                 spot_id = artist.get('spotify_id', None)
                 spot_url = artist.get('spotify_url', None)
                 image_url = artist.get('image_url', None)
 
-                attraction_id = self.get_attraction_id(name, spot_url)
-
                 if attraction_id == None:
                     print(f'Could not get artist TM ID for {name}')
                     continue
@@ -41,19 +133,83 @@ class TicketmasterAPI:
         return None
 
 
+    def resolve_attraction_ids(self, artists, concurrent=True):
+        ''' returns a list of attraction ids in the same order as the artists passed in, None for artists ticketmaster does not know. checks saved artists and lookups before requesting ticketmaster and adds every new lookup to be commited '''
+
+        spotify_ids = [artist.get('spotify_id', None) for artist in artists if artist.get('spotify_id', None)]
+
+            # artists already in the data base have a known attraction id
+        saved_artists = {artist.spotify_id: artist.attraction_id for artist in Artist.query.filter(Artist.spotify_id.in_(spotify_ids)).all()} if spotify_ids else {}
+        lookups = AttractionLookup.get_fresh(spotify_ids)
+
+        attraction_ids = [None] * len(artists)
+        to_request = []
+
+        for i, artist in enumerate(artists):
+            spot_id = artist.get('spotify_id', None)
+
+            if spot_id in saved_artists:
+                attraction_ids[i] = saved_artists[spot_id]
+            elif spot_id in lookups:
+                attraction_ids[i] = lookups[spot_id].attraction_id
+            else:
+                to_request.append(i)
+
+        if not to_request:
+            return attraction_ids
+
+        def request_id(i):
+            try:
+                return self.get_attraction_id(artists[i].get('name', None), artists[i].get('spotify_url', None))
+            except (RateLimitError, TicketmasterError) as e:
+                print(f'Could not get TM ID for {artists[i].get("name", None)}: {e}')
+                return LOOKUP_FAILED
+
+        if concurrent and self.max_workers > 1 and len(to_request) > 1:
+                # map keeps the results in the same order as the artists passed in
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_request))) as executor:
+                requested = list(executor.map(request_id, to_request))
+        else:
+            requested = [request_id(i) for i in to_request]
+
+        for i, attraction_id in zip(to_request, requested):
+                # failed lookups are not saved so they are requested again next time
+            if attraction_id is LOOKUP_FAILED:
+                continue
+
+            attraction_ids[i] = attraction_id
+            spot_id = artists[i].get('spotify_id', None)
+
+                # saves misses too so unknown artists are not requested again until the miss expires
+            if spot_id:
+                AttractionLookup.record(spot_id, artists[i].get('spotify_url', None), attraction_id)
+
+            # the caller commits the lookups with the rest of its changes
+        db.session.flush()
+
+        return attraction_ids
+
+
     def get_attraction_id(self, name, spotify_url):
-        ''' takes in name and spotify url and checks if the artist by name has the same spotify url in the ticketmaster data'''
+        ''' takes in name and spotify url and checks if the artist by name has the same spotify url in the ticketmaster data. returns None if ticketmaster has no match, raises TicketmasterError if the request failed'''
 
         if name:
-            res = requests.get(
-                f'{self.base_url}/attractions.json',
+            res = self.request(
+                'attractions.json',
                 params={
                     'keyword': name,
                     'apikey': self.api_key
                 }
             )
 
-            data = res.json()
+            try:
+                data = res.json()
+            except ValueError as e:
+                raise TicketmasterError(f'could not read attractions.json: {e}') from e
+
+                # an error body is not an answer, the artist may still be on ticketmaster
+            if not isinstance(data, dict) or 'fault' in data or 'errors' in data:
+                raise TicketmasterError(f'attractions.json answered with an error: {str(data)[:200]}')
 
             artists = data.get('_embedded', {}).get('attractions', [{}])
 
@@ -67,135 +223,204 @@ class TicketmasterAPI:
         return None
 
 
-    def add_events_to_db(self, artists, geohash=None):
-        ''' adds event to data base after getting events based on location and artist then checking if it already exists'''
+    def add_events_to_db(self, artists, geohash=None, concurrent=True):
+        ''' adds events to data base after getting events based on location and artist. artists are requested at the same time unless concurrent is False. all new events are saved in one transaction, returns how many were added '''
 
-            # for each artist, requests the artists events
-        for artist in artists:
-            events_added = 0
-            seen_events= []
+        artists = [artist for artist in artists if artist]
+        if not artists:
+            return 0
 
-            if not artist:
-                break
+            # reads artist columns here so the threads below never touch the data base session
+        attraction_ids = [artist.attraction_id for artist in artists]
+        artist_ids = [artist.id for artist in artists]
 
-            if geohash:
-                    # gets events near users zipcode
-                params = {
-                    'attractionId': artist.attraction_id,
-                    'geoPoint': geohash,
-                    'sort': 'distance,date,asc',
-                    'apikey': self.api_key
-                }
-            else:
-                params = {
-                    'attractionId': artist.attraction_id,
-                    'sort': 'relevance,desc',
-                    'apikey': self.api_key
-                }
+        if concurrent and self.max_workers > 1 and len(artists) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(artists))) as executor:
+                results = list(executor.map(lambda attraction_id: self.get_artist_events(attraction_id, geohash=geohash), attraction_ids))
+        else:
+            results = [self.get_artist_events(attraction_id, geohash=geohash) for attraction_id in attraction_ids]
+
+        new_events = []
+        refreshed_at = utc_now()
+
+        for artist, artist_id, events in zip(artists, artist_ids, results):
+                # None means the request failed, those artists are tried again on the next refresh
+            if events is None:
+                continue
+
+            for event in events:
+                event['artist_id'] = artist_id
+            new_events.extend(events)
+            artist.events_refreshed_at = refreshed_at
+
+        added = Event.add_events(new_events)
+        db.session.commit()
 
+        return added
+
+
+    def paginate_events(self, params, page_size=None, max_pages=None, prefetch=True):
+        ''' yields parsed events from events.json one page at a time. the next page is requested while the current one is read unless prefetch is False, and no more pages are requested once the caller stops. stops after max_pages pages or the last page. raises RateLimitError if a page is still rate limited and TicketmasterError if a page fails '''
+
+        page_size = page_size or self.page_size
+        max_pages = min(max_pages or self.max_pages, DEEP_PAGING_LIMIT // page_size)
+
+        def fetch(page):
+            res = self.request('events.json', params={**params, 'size': page_size, 'page': page})
             try:
-                res = requests.get(f'{self.base_url}/events.json', params=params)
-                response_json = res.json()
-                event_data = response_json.get('_embedded', {}).get('events', [])
+                return parse_page_info(res.content)
+            except ValueError as e:
+                raise TicketmasterError(f'could not read events.json page {page}: {e}') from e
+
+        next_page = None
+        page = 0
+
+        try:
+            events, total_pages = fetch(page)
+
+            while True:
+                last_page = not events or page + 1 >= max_pages or (total_pages is not None and page + 1 >= total_pages)
+
+                if prefetch and not last_page:
+                    next_page = self.prefetch_executor.submit(fetch, page + 1)
+
+                for event in events:
+                    yield event
+
+                if last_page:
+                    return
+
+                page += 1
+                events, total_pages = next_page.result() if next_page else fetch(page)
+                next_page = None
+
+        finally:
+                # the caller stopped early, a page that has not been sent yet is never sent
+            if next_page:
+                next_page.cancel()
+
+
+    def get_artist_events(self, attraction_id, geohash=None, max_events=2):
+        ''' requests an artists events and returns up to max_events parsed events, None if the request failed '''
+
+        if geohash:
+                # gets events near users zipcode
+            params = {
+                'attractionId': attraction_id,
+                'geoPoint': geohash,
+                'sort': 'distance,date,asc',
+                'apikey': self.api_key
+            }
+        else:
+            params = {
+                'attractionId': attraction_id,
+                'sort': 'relevance,desc',
+                'apikey': self.api_key
+            }
+
+        events = []
+        seen_events = set()
+
+        try:
+                # a few more than max_events in case of repeats, the second page is only requested if they were not enough
+            with closing(self.paginate_events(params, page_size=max_events * 5, max_pages=2, prefetch=False)) as event_data:
 
-                if not event_data:
-                    continue
-            
                     # itterates over all events from specific artist
                 for event in event_data:
-                    if events_added >= 2:
+                    if event.event_id in seen_events:
+                        continue
+
+                    seen_events.add(event.event_id)
+                    events.append(event.to_dict())
+
+                    if len(events) >= max_events:
                         break
-                    
-                    event_id = event.get('id', None)
 
-                    if event_id in seen_events:
-                        continue
+        except Exception as e:
+            print(f'error making request: {e}')
+            return None
+
+        return events
+
 
-                    created_event = CreateEvent(event)
-                    new_event = created_event.create_event()
+    def get_generic_events(self, geohash=None, save=False):
+        ''' gets generic events based on only users location. results are cached by the geohash cut to geohash_precision so nearby users share them. save also adds newly requested events and their venues to the data base so later nearby searches can be answered from it '''
 
-                        # checks if event already exists
-                    existing_event = Event.query.filter_by(event_id=new_event['event_id']).first()
+        area = geohash[:self.geohash_precision] if geohash else None
 
-                    if not existing_event:
-                        event_to_add = Event(**new_event)
-                        db.session.add(event_to_add)
-                        db.session.commit()
+        def request_events():
+            events = self.request_generic_events(geohash=area)
+            if events and save:
+                Event.add_events(events)
+                db.session.commit()
+            return events
 
-            except Exception as e:
-                print(f'error making request: {e}')
-                break
+        return self.generic_events_cache.get_or_set(('generic_events', area), request_events)
 
 
-    def get_generic_events(self, geohash=None):
-        ''' gets generic events based on only users location '''
+    def request_generic_events(self, geohash=None):
+        ''' requests generic events based on only users location. pages are read until there are 20 events with different artists, the last page or max_pages. returns the events found before a failed or rate limited request, an empty list if there were none '''
 
         events = []
-        seen_artists = []
+        seen_artists = set()
         num_events = 20
-        page = 0
-
-        while len(events) < num_events:
 
-            if geohash:
-                params = {
-                    'classificationName': 'music',
-                    'geoPoint': geohash,
-                    'radius': '50',
-                    'unit': 'miles',
-                    'page': page,
-                    'sort': 'relevance,desc',
-                    'apikey': self.api_key
-                }
-            else:
-                params={
-                    'classificationName': 'music',
-                    'sort': 'relevance,desc',
-                    'page': page,
-                    'apikey': self.api_key
-                }
+        if geohash:
+            params = {
+                'classificationName': 'music',
+                'geoPoint': geohash,
+                'radius': '50',
+                'unit': 'miles',
+                'sort': 'relevance,desc',
+                'apikey': self.api_key
+            }
+        else:
+            params={
+                'classificationName': 'music',
+                'sort': 'relevance,desc',
+                'apikey': self.api_key
+            }
+
+        try:
+            with closing(self.paginate_events(params)) as event_data:
+
+                    # itterates over all events
+                for event in event_data:
 
-            res = requests.get(
-                f'{self.base_url}/events.json', params=params)
-            
-            event_data = res.json().get('_embedded', {}).get('events', [{}])
+                        # cant append duplicate artists
+                    if event.artist in seen_artists:
+                        continue
 
-                # itterates over all events
-            for event in event_data:
-                if len(events) >= num_events:
-                    break
+                    seen_artists.add(event.artist)
+                    events.append(event.to_dict())
 
-                artist = event.get('_embedded', {}).get('attractions', [{}])[0].get('name', event.get('name'))
+                    if len(events) >= num_events:
+                        break
 
-                    # cant append duplicate artists
-                if artist in seen_artists:
-                    continue
-                
-                seen_artists.append(artist)
-                new_event = CreateEvent(event)
-                events.append(new_event.create_event())
-            page += 1                
+        except (RateLimitError, TicketmasterError) as e:
+                # returns the events found so far instead of failing the page, the carousels are shown empty if there are none
+            print(f'Error getting generic events: {e}')
 
-        return events if events else None
+        return events
     
 
     def get_event(self, event_id):
         ''' rquests single specific event data based on event id'''
         
         if event_id:
-            res = requests.get(
-                f'{self.base_url}/events',
-                params={
-                    'id': event_id,
-                    'apikey': self.api_key
-                }
-            )
-
-            event_data = res.json().get('_embedded', {}).get('events', [{}])[0]
+            try:
+                res = self.request(
+                    'events',
+                    params={
+                        'id': event_id,
+                        'apikey': self.api_key
+                    }
+                )
+                event_data = parse_page(res.content)
+            except (RateLimitError, TicketmasterError, ValueError) as e:
+                print(f'Error getting event {event_id}: {e}')
+                return None
 
             if event_data:
-                new_event = CreateEvent(event_data)
-                event = new_event.create_event()
-
-                return event
+                return event_data[0].to_dict()
 
@@ -0,0 +1,58 @@
+from functools import cached_property, wraps
+from flask import g
+
+from models import db, WishList, SpotifyProfile
+
+
+class UserContext:
+    ''' holds the logged in user for one request. relationships are queried the first time they are used and reused for the rest of the request '''
+
+    def __init__(self, user):
+        self.user = user
+
+
+    def load(self, *relationships):
+        ''' loads the named relationships now, used by routes to declare what they need up front '''
+
+        for relationship in relationships:
+            getattr(self, relationship)
+
+
+    def reset(self, *relationships):
+        ''' forgets the named relationships so they are queried again, used after they are changed '''
+
+        for relationship in relationships:
+            self.__dict__.pop(relationship, None)
+
+
+    @cached_property
+    def artists(self):
+        ''' list of the users top artists '''
+
+        return self.user.artists.all()
+
+
+    def wishlisted(self, event_ids):
+        ''' set of the given event ids that are on the users wishlist. only those ids are looked up so big wishlists are never loaded '''
+
+        return WishList.get_wishlisted(self.user.id, event_ids)
+
+
+    @cached_property
+    def spotify_profile(self):
+        ''' the users saved spotify top artists and tracks, None if they were never fetched '''
+
+        return db.session.get(SpotifyProfile, self.user.id)
+
+
+def uses_user(*relationships):
+    ''' route decorator that loads the named relationships of the logged in user before the route runs '''
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.get('user_ctx'):
+                g.user_ctx.load(*relationships)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator